@@ -0,0 +1,363 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+import discord
+import numpy as np
+
+# 라이브 DB 없이 돌 수 있도록 기본은 mongomock (개발 의존성: pipenv install --dev 또는 pip install mongomock)
+# 단일 로컬 mongod는 트랜잭션을 지원하지 않으므로 MONGODB_URI=mongodb://localhost:27017 MONGODB_TLS=0 MONGODB_TRANSACTIONS=0
+os.environ.setdefault('MONGODB_URI', 'mongomock://')
+
+import discordbot
+from discordbot import CatalogIndex, round_to_nearest, round_and_adjust, round_to_nearest_batch, round_and_adjust_batch
+
+# 자동 완성 마이크로 벤치마크: 10k개 아이템에서 한 글자씩 입력할 때의 응답 시간 측정
+CATALOG_SIZE = 10000
+QUERIES = 200
+
+# 기존 방식: 매 입력마다 목록 전체를 순회하며 부분 문자열 검사
+def linear_search(names, current):
+    return [item for item in names if current.lower() in item.lower()][:25]
+
+def random_name(rng):
+    words = rng.randint(1, 3)
+    return " ".join("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9))) for _ in range(words))
+
+def time_keystrokes(search, queries):
+    timings = []
+    for query in queries:
+        # 사용자가 한 글자씩 입력하는 상황을 재현
+        for end in range(1, len(query) + 1):
+            start = time.perf_counter()
+            search(query[:end])
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings
+
+def report(label, timings):
+    mean = sum(timings) / len(timings)
+    p99 = timings[int(len(timings) * 0.99)]
+    print(f"{label:<10} keystrokes={len(timings)} mean={mean * 1e6:.1f}us p99={p99 * 1e6:.1f}us")
+
+def bench_autocomplete():
+    rng = random.Random(0)
+    names = list({random_name(rng) for _ in range(CATALOG_SIZE)})
+    popularity = {name: rng.randint(0, 100) for name in rng.sample(names, len(names) // 10)}
+    queries = [rng.choice(names)[rng.randint(0, 2):] for _ in range(QUERIES)]
+
+    start = time.perf_counter()
+    index = CatalogIndex(names)
+    print(f"index build: {len(names)} items in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    report("linear", time_keystrokes(lambda q: linear_search(names, q), queries))
+    report("index", time_keystrokes(lambda q: index.search(q, 25, popularity), queries))
+
+# 가격 계산 벤치마크: 아이템별 Decimal 반올림과 배열 단위 반올림 비교
+PRICING_SIZE = 100000
+
+# 배열 단위 반올림이 기존 함수와 정확히 같은 값을 내는지 확인 (반올림 경계 값 포함)
+def check_rounding_equivalence(rng, count=PRICING_SIZE):
+    values = [rng.uniform(0, 100000) * 0.7 * rng.choice([1, 0.0001, rng.random()]) for _ in range(count)]
+    values += [k / 200 for k in range(20000)] + [k / 2000 for k in range(20000)]  # .xx5, .xxx5 경계
+    values += [k * 0.7 * 0.0001 for k in range(20000)] + [0.0, 0.005, 0.0005, 1e-9]
+    ties = np.array(values[count:])
+    values += np.nextafter(ties, np.inf).tolist() + np.nextafter(ties, -np.inf).tolist()
+    values += [rng.randint(1, 10 ** 9) / 200 for _ in range(count)]  # 큰 값의 경계
+    array = np.array(values)
+    for scalar, batch in ((round_to_nearest, round_to_nearest_batch), (round_and_adjust, round_and_adjust_batch)):
+        expected = [scalar(value) for value in values]
+        actual = batch(array).tolist()
+        mismatches = sum(1 for e, a in zip(expected, actual) if e != a)
+        print(f"{scalar.__name__}: {len(values)} values, {mismatches} mismatches")
+        assert mismatches == 0
+
+def bench_pricing():
+    rng = random.Random(0)
+    check_rounding_equivalence(rng)
+
+    cash = np.array([rng.randint(1, 100000) * 0.7 for _ in range(PRICING_SIZE)])
+    discount_factor = 1 - 15 / 100
+
+    start = time.perf_counter()
+    per_item = [round_to_nearest(round_to_nearest(price * discount_factor) * 0.0001) for price in cash.tolist()]
+    per_item_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = round_to_nearest_batch(round_to_nearest_batch(cash * discount_factor) * 0.0001)
+    batched_time = time.perf_counter() - start
+
+    assert per_item == batched.tolist()
+    print(f"discount + rate conversion for {PRICING_SIZE} prices: per-item {per_item_time * 1000:.1f}ms, batched {batched_time * 1000:.1f}ms")
+
+# 부하 테스트: 가짜 Interaction으로 실제 커맨드 코루틴을 N명의 동시 사용자가 호출하는 상황을 재현
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def send_message(self, content=None, **kwargs):
+        self.done = True
+
+    async def edit_message(self, **kwargs):
+        self.done = True
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+class FakeFollowup:
+    async def send(self, content=None, **kwargs):
+        pass
+
+class FakePermissions:
+    administrator = True
+
+class FakeUser:
+    guild_permissions = FakePermissions()
+
+    def __init__(self, user_id):
+        self.id = user_id
+        self.display_name = f'user{user_id}'
+
+interaction_ids = itertools.count(1)
+
+class FakeInteraction:
+    type = discord.InteractionType.application_command
+
+    def __init__(self, command, user_id, guild_id):
+        self.id = next(interaction_ids)
+        self.command = command
+        self.user = FakeUser(user_id)
+        self.guild_id = guild_id
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+        self.extras = {}
+
+# 워크로드 이름 -> (커맨드, 인자 생성 함수)
+def workload_ops(items):
+    return {
+        'add': (discordbot.add_item, lambda rng: (rng.choice(items), rng.randint(1, 5))),
+        'remove': (discordbot.remove_item, lambda rng: (rng.choice(items), 1)),
+        'price': (discordbot.update_price, lambda rng: (rng.choice(items), rng.randint(1, 100000))),
+        'sell': (discordbot.sell_item, lambda rng: (rng.randint(1000, 100000), 'buyer', rng.choice(items), rng.randint(1, 3))),
+        'show_sales': (discordbot.show_sales, lambda rng: ()),
+        'inventory': (discordbot.show_inventory, lambda rng: ()),
+        'sell_message': (discordbot.sell_message, lambda rng: ()),
+        'buy_message': (discordbot.buy_message, lambda rng: ()),
+        'discount': (discordbot.discount_creatures, lambda rng: (rng.randint(0, 50),)),
+        'settle': (discordbot.reset_sales, lambda rng: ()),
+        'autocomplete': (None, lambda rng: (rng.choice(items)[:rng.randint(1, 4)],)),
+    }
+
+DEFAULT_MIX = 'add=20,sell=20,autocomplete=30,sell_message=10,buy_message=5,inventory=5,show_sales=5,price=5'
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+async def run_op(name, command, args, user_id, guild_id):
+    if command is None:
+        # 자동 완성은 커맨드가 아니므로 트리를 거치지 않고 직접 호출
+        discordbot.current_command.set(name)
+        await discordbot.autocomplete_items(FakeInteraction(None, user_id, guild_id), *args)
+        return
+    interaction = FakeInteraction(command, user_id, guild_id)
+    await discordbot.bot.tree.interaction_check(interaction)
+    await command.callback(interaction, *args)
+    discordbot.record_command(interaction, 'ok')
+
+def percentile(timings, q):
+    return timings[min(int(len(timings) * q), len(timings) - 1)]
+
+async def run_load(users, ops, guilds, mix, seed):
+    await discordbot.load_catalog()
+    await discordbot.ensure_indexes()
+    items = sorted(discordbot.catalog.names)
+    available = workload_ops(items)
+    weights = parse_mix(mix)
+    unknown = set(weights) - set(available)
+    if unknown:
+        raise SystemExit(f"unknown workload ops: {', '.join(sorted(unknown))} (available: {', '.join(sorted(available))})")
+    names = list(weights)
+
+    # 판매가 재고 부족으로 끝나지 않도록 모든 서버에 넉넉한 재고를 채움
+    for guild_id in range(1, guilds + 1):
+        state = await discordbot.guild_states.get(guild_id)
+        for item in items:
+            await discordbot.increment_stock(state, item, ops * 3)
+    discordbot.metrics.clear()
+
+    timings = {name: [] for name in names}
+    errors = dict.fromkeys(names, 0)
+    remaining = [ops]
+
+    async def user(user_id):
+        rng = random.Random(seed + user_id)
+        guild_id = user_id % guilds + 1
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            name = rng.choices(names, [weights[name] for name in names])[0]
+            command, make_args = available[name]
+            start = time.perf_counter()
+            try:
+                # 사용자마다 별도의 태스크로 실행해 커맨드별 DB 호출 집계가 섞이지 않게 함
+                await asyncio.create_task(run_op(name, command, make_args(rng), user_id, guild_id))
+            except Exception as e:
+                errors[name] += 1
+                print(f'{name} failed: {e!r}')
+            timings[name].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in range(users)))
+    elapsed = time.perf_counter() - start
+    await discordbot.flush_all_writers()
+
+    db_calls = {}
+    for (metric, labels), value in discordbot.metrics.snapshot()[0]:
+        if metric == 'db_calls_total':
+            command = dict(labels)['command']
+            db_calls[command] = db_calls.get(command, 0) + value
+
+    commands = {}
+    for name in names:
+        samples = sorted(timings[name])
+        if not samples:
+            continue
+        # 메트릭의 커맨드 이름은 디스코드 커맨드 이름 (자동 완성은 워크로드 이름)
+        command = available[name][0]
+        metric_name = command.name if command is not None else name
+        commands[name] = {
+            'count': len(samples),
+            'errors': errors[name],
+            'p50_ms': percentile(samples, 0.5) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'mean_ms': sum(samples) / len(samples) * 1000,
+            'db_calls_per_op': db_calls.get(metric_name, 0) / len(samples),
+        }
+    total = sum(len(samples) for samples in timings.values())
+    return {'elapsed_s': elapsed, 'ops': total, 'ops_per_sec': total / elapsed, 'commands': commands}
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_load(args):
+    result = asyncio.run(run_load(args.users, args.ops, args.guilds, args.mix, args.seed))
+    result = {
+        'revision': git_revision(),
+        'backend': 'mongomock' if discordbot.IN_MEMORY_DB else 'mongod',
+        'users': args.users,
+        'guilds': args.guilds,
+        'mix': args.mix,
+        **result,
+    }
+    print(f"{result['ops']} ops by {args.users} users in {result['elapsed_s']:.2f}s ({result['ops_per_sec']:.0f} ops/sec, {result['backend']})")
+    for name, stats in result['commands'].items():
+        print(f"{name:<13} n={stats['count']:<6} p50={stats['p50_ms']:.2f}ms p99={stats['p99_ms']:.2f}ms db_calls/op={stats['db_calls_per_op']:.2f} errors={stats['errors']}")
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f'results written to {args.output}')
+
+# 내보내기/가져오기 왕복 확인: 실제 크기의 디스코드 ID로 판매 원장을 내보내고 같은 서버에 두 번 다시 가져와도
+# 이벤트가 늘지 않고 ID가 그대로인지 확인 (2^53보다 큰 ID가 float을 거치면 값이 바뀜)
+ROUNDTRIP_GUILD_ID = 1098765432109876543
+ROUNDTRIP_USER_ID = 987654321098765432
+
+async def check_import_roundtrip():
+    await discordbot.load_catalog()
+    await discordbot.ensure_indexes()
+    item = discordbot.catalog.names[0]
+    state = await discordbot.guild_states.get(ROUNDTRIP_GUILD_ID)
+    await discordbot.increment_stock(state, item, 1)
+    interaction = FakeInteraction(discordbot.sell_item, ROUNDTRIP_USER_ID, ROUNDTRIP_GUILD_ID)
+    await discordbot.sell_item.callback(interaction, 100, 'buyer', item, 1)
+    query = {'guild_id': ROUNDTRIP_GUILD_ID}
+    for file_format in ('csv', 'jsonl'):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f'sales.{file_format}.gz')
+            await discordbot.sales_collection.run(discordbot._export_records, 'sales', ROUNDTRIP_GUILD_ID, file_format, path)
+            for _ in range(2):
+                await discordbot.import_records(state, 'sales', path, file_format, True)
+        events = await discordbot.sales_collection.find_list(query)
+        totals = await discordbot.period_totals(ROUNDTRIP_GUILD_ID, 0)
+        print(f"{file_format} round trip: {len(events)} events, user_id={events[0]['user_id']}, period total={totals['total']}")
+        assert len(events) == 1 and events[0]['user_id'] == ROUNDTRIP_USER_ID and totals['total'] == 100
+
+# 시작 시간 측정: 새 프로세스에서 모듈을 불러오고 첫 커맨드에 응답하기까지 걸린 시간 (스냅샷 없음/있음)
+STARTUP_SCRIPT = """
+import asyncio, os, sys, time
+start = time.perf_counter()
+import discordbot
+imported = time.perf_counter()
+import benchmark
+
+async def main():
+    async def skip_sync(**kwargs):
+        pass
+    discordbot.bot.tree.sync = skip_sync
+    await discordbot.startup()
+    interaction = benchmark.FakeInteraction(discordbot.sell_message, 1, 1)
+    await discordbot.bot.tree.interaction_check(interaction)
+    await discordbot.sell_message.callback(interaction)
+    served = time.perf_counter()
+    await discordbot.save_snapshot()
+    print(imported - start, served - start)
+    sys.stdout.flush()
+    os._exit(0)
+asyncio.run(main())
+"""
+
+def bench_startup(runs=3):
+    with tempfile.TemporaryDirectory() as base_dir:
+        env = dict(os.environ, BASE_DIR=base_dir, SCRAPE_INTERVAL_MINUTES='0')
+        for label in ('cold', 'warm snapshot'):
+            imports, firsts = [], []
+            for _ in range(runs):
+                if label == 'cold':
+                    for name in os.listdir(base_dir):
+                        os.remove(os.path.join(base_dir, name))
+                output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], env=env, capture_output=True, text=True, check=True,
+                                        cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+                imported, served = map(float, output.strip().splitlines()[-1].split())
+                imports.append(imported)
+                firsts.append(served)
+            print(f"{label:<14} import={min(imports) * 1000:.0f}ms first command={min(firsts) * 1000:.0f}ms (best of {runs})")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the shop bot.')
+    subparsers = parser.add_subparsers(dest='suite')
+    subparsers.add_parser('micro', help='autocomplete and pricing micro benchmarks (default)')
+    load_parser = subparsers.add_parser('load', help='replay a command workload with fake interactions')
+    load_parser.add_argument('--users', type=int, default=20, help='concurrent users')
+    load_parser.add_argument('--ops', type=int, default=2000, help='total commands to run')
+    load_parser.add_argument('--guilds', type=int, default=1, help='guilds the users are spread across')
+    load_parser.add_argument('--mix', default=DEFAULT_MIX, help='workload weights, e.g. "add=3,sell=2,autocomplete=5"')
+    load_parser.add_argument('--seed', type=int, default=0)
+    load_parser.add_argument('--output', default='benchmark-results.json')
+    subparsers.add_parser('startup', help='time from process start to the first served command')
+    args = parser.parse_args()
+
+    if args.suite == 'load':
+        bench_load(args)
+    elif args.suite == 'startup':
+        bench_startup()
+    else:
+        bench_autocomplete()
+        bench_pricing()
+        asyncio.run(check_import_roundtrip())
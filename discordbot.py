@@ -1,41 +1,394 @@
 import os
+import sys
+import asyncio
+import functools
+import contextlib
+import contextvars
 import random
-import requests
-from bs4 import BeautifulSoup
-from pymongo import MongoClient
+import aiohttp
+import numpy as np
+from pymongo import MongoClient, UpdateOne, ReplaceOne, ReturnDocument, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import re
+import csv
+import math
+import hashlib
+import gzip
+import json
+import tempfile
+import difflib
+import bisect
+import heapq
+from collections import Counter, OrderedDict, namedtuple
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 import threading
+import signal
+import socket
 import time
-from decimal import Decimal, ROUND_HALF_UP
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from bson.objectid import ObjectId
 
+# 지연 시간 히스토그램의 버킷 경계(초), 상호작용은 3초 안에 응답해야 함
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10)
+INTERACTION_DEADLINE = 3
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    # 버킷 경계로 근사한 분위수 (마지막 버킷을 넘으면 inf)
+    def quantile(self, q):
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+# 커맨드/DB/HTTP 지연 시간과 호출 수를 모아 Prometheus 텍스트 형식으로 내보내는 저장소
+# (pymongo 리스너와 DB 스레드에서도 기록하므로 잠금으로 보호하고, 읽을 때는 복사본을 씀)
+class Metrics:
+    def __init__(self):
+        self.histograms = {}  # (이름, 라벨) -> Histogram
+        self.counters = Counter()  # (이름, 라벨) -> 값
+        self.gauges = {}  # (이름, 라벨) -> 값
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    # 잠금 안에서 복사한 (카운터, 게이지, 히스토그램) 목록
+    def snapshot(self):
+        with self.lock:
+            histograms = []
+            for key, histogram in self.histograms.items():
+                copy = Histogram(histogram.buckets)
+                copy.counts, copy.count, copy.sum = list(histogram.counts), histogram.count, histogram.sum
+                histograms.append((key, copy))
+            return list(self.counters.items()), list(self.gauges.items()), histograms
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def histogram(self, name, **labels):
+        with self.lock:
+            return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def counter(self, name, **labels):
+        with self.lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render_prometheus(self):
+        def format_labels(labels, **extra):
+            pairs = list(labels) + list(extra.items())
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+        counters, gauges, histograms = self.snapshot()
+        lines = []
+        for kind, values in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({name for (name, _), _ in values}):
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(f'{name}{format_labels(labels)} {value}' for (key, labels), value in values if key == name)
+        for name in sorted({name for (name, _), _ in histograms}):
+            lines.append(f'# TYPE {name} histogram')
+            for (key, labels), histogram in histograms:
+                if key != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+                lines.append(f'{name}_bucket{format_labels(labels, le="+Inf")} {histogram.count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+# 지금 처리 중인 슬래시 커맨드 이름 (DB/HTTP 호출을 커맨드별로 집계할 때 사용)
+current_command = contextvars.ContextVar('current_command', default='background')
+
+# pymongo가 실제로 서버에 보낸 명령마다 왕복 횟수와 지연 시간을 기록
+# (트랜잭션처럼 한 번의 DB 호출 안에서 여러 명령을 보내는 경우까지 포함)
+class MongoCommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics.inc('db_roundtrips_total', command=current_command.get(), op=event.command_name)
+        metrics.observe('db_roundtrip_seconds', event.duration_micros / 1e6, op=event.command_name)
+
+    def failed(self, event):
+        metrics.inc('db_roundtrips_total', command=current_command.get(), op=event.command_name)
+        metrics.inc('db_errors_total', op=event.command_name)
+
 # MongoDB 연결 설정
+# (mongomock:// 이면 메모리 안의 mongomock을 사용하고, 로컬 mongod는 MONGODB_TLS=0으로 연결,
+#  복제 세트가 아닌 단일 mongod에서는 MONGODB_TRANSACTIONS=0도 필요)
+# 클라이언트는 처음 DB를 쓸 때 스레드 풀 안에서 만들어지므로 mongodb+srv의 DNS 조회가 시작을 막지 않음
 MONGODB_URI = os.getenv('MONGODB_URI')
-client = MongoClient(MONGODB_URI, tls=True, tlsAllowInvalidCertificates=True)
-db = client.creatures_db
-inventory_collection = db['inventory']
-prices_collection = db['prices']
-sales_collection = db['sales']
-
-# 고정된 아이템 목록 (영어 순으로 정렬, 새로운 항목 추가)
-creatures = [
+MONGODB_TLS = os.getenv('MONGODB_TLS', '1') == '1'
+IN_MEMORY_DB = (MONGODB_URI or '').startswith('mongomock://')
+client = None
+client_lock = threading.Lock()
+
+def create_mongo_client(uri):
+    if IN_MEMORY_DB:
+        import mongomock
+        return mongomock.MongoClient()
+    tls_options = {'tls': True, 'tlsAllowInvalidCertificates': True} if MONGODB_TLS else {}
+    return MongoClient(uri, event_listeners=[MongoCommandMetrics()], **tls_options)
+
+def get_client():
+    global client
+    with client_lock:
+        if client is None:
+            client = create_mongo_client(MONGODB_URI)
+        return client
+
+def get_database():
+    return get_client().creatures_db
+
+# pymongo 호출은 블로킹이므로 크기가 제한된 스레드 풀에서 실행
+DB_MAX_WORKERS = int(os.getenv('DB_MAX_WORKERS', '4'))
+db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix='mongo')
+
+# pymongo 컬렉션을 감싸 모든 호출을 스레드 풀로 넘기는 비동기 래퍼
+# (Motor 등 같은 인터페이스를 가진 다른 백엔드로 교체 가능)
+class AsyncCollection:
+    def __init__(self, collection, executor=db_executor):
+        # collection은 pymongo 컬렉션이나, 처음 쓸 때 연결할 컬렉션 이름
+        self._collection = collection
+        self.executor = executor
+
+    @property
+    def collection(self):
+        if isinstance(self._collection, str):
+            self._collection = get_database()[self._collection]
+        return self._collection
+
+    async def run(self, func, *args, **kwargs):
+        # 스레드에서도 current_command를 볼 수 있도록 컨텍스트를 복사해서 실행
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        op = getattr(func, '__name__', 'call').lstrip('_')
+        metrics.inc('db_calls_total', command=current_command.get(), op=op)
+        with metrics.timer('db_call_seconds', op=op):
+            return await loop.run_in_executor(self.executor, context.run, functools.partial(func, *args, **kwargs))
+
+    async def find_list(self, *args, sort=None, limit=0, **kwargs):
+        # 커서 순회도 네트워크 I/O이므로 스레드 안에서 리스트로 만들어 반환
+        def find():
+            cursor = self.collection.find(*args, **kwargs)
+            if sort:
+                cursor = cursor.sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            return list(cursor)
+        return await self.run(find)
+
+    async def aggregate_list(self, pipeline, **kwargs):
+        def aggregate():
+            return list(self.collection.aggregate(pipeline, **kwargs))
+        return await self.run(aggregate)
+
+    def __getattr__(self, name):
+        # 연결 전에도 메서드를 꺼낼 수 있도록 실제 메서드는 스레드 안에서 찾음
+        def method(*args, **kwargs):
+            return getattr(self.collection, name)(*args, **kwargs)
+        method.__name__ = name
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        return call
+
+inventory_collection = AsyncCollection('inventory')
+prices_collection = AsyncCollection('prices')
+sales_collection = AsyncCollection('sales')
+creatures_collection = AsyncCollection('creatures')
+catalog_collection = AsyncCollection('catalog')
+rollups_collection = AsyncCollection('sales_rollups')
+jobs_collection = AsyncCollection('jobs')
+price_history_collection = AsyncCollection('price_history')
+settings_collection = AsyncCollection('guild_settings')
+
+# catalog 컬렉션이 비어 있을 때 채워 넣는 기본 아이템 목록 (영어 순으로 정렬)
+DEFAULT_CREATURES = [
     "aidoneiscus", "angelic warden", "aolenus", "ardor warden", "boreal warden", "caldonterrus", 
     "corsarlett", "cuxena", "eigion warden", "garra warden", "ghartokus", "golgaroth", 
     "hellion warden", "jhiggo jangl", "jotunhel", "luxces", "lus adarch", "magnacetus", 
     "menace", "mijusuima", "nolumoth", "pacedegon", "parahexilian", "sang toare", "takamorath", 
     "umbraxi", "urzuk", "verdent warden", "voletexius", "whispthera", "woodralone", "yohsog"
 ]
-items = ["death gacha token", "revive token", "max growth token", "partial growth token", "strong glimmer token", "appearance change token"]
+DEFAULT_ITEMS = ["death gacha token", "revive token", "max growth token", "partial growth token", "strong glimmer token", "appearance change token"]
+
+# 자동 완성과 아이템 확인을 위한 카탈로그 색인 (카탈로그가 바뀔 때마다 새로 생성)
+class CatalogIndex:
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.members = frozenset(self.names)
+        self.lowered = tuple(name.lower() for name in self.names)
+        # 접두사 검색용 정렬 목록과 1~3글자 부분 문자열 -> 아이템 번호 색인
+        self.sorted_keys = sorted((lowered, i) for i, lowered in enumerate(self.lowered))
+        self.grams = {}
+        for i, lowered in enumerate(self.lowered):
+            for size in (1, 2, 3):
+                for start in range(len(lowered) - size + 1):
+                    self.grams.setdefault(lowered[start:start + size], set()).add(i)
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefix_matches(self, query):
+        matches = set()
+        start = bisect.bisect_left(self.sorted_keys, (query, -1))
+        for lowered, i in self.sorted_keys[start:]:
+            if not lowered.startswith(query):
+                break
+            matches.add(i)
+        return matches
+
+    def substring_matches(self, query):
+        if len(query) <= 3:
+            return self.grams.get(query, set())
+        # 모든 3글자 조각을 포함하는 후보만 남긴 뒤 실제 포함 여부 확인
+        candidates = None
+        for start in range(len(query) - 2):
+            ids = self.grams.get(query[start:start + 3])
+            if not ids:
+                return set()
+            candidates = set(ids) if candidates is None else candidates & ids
+        return {i for i in candidates if query in self.lowered[i]}
+
+    # 접두사 일치 -> 중간 일치 순으로, 같은 그룹 안에서는 많이 쓰인 아이템을 먼저 반환
+    def search(self, query, limit=25, popularity=None):
+        query = query.lower()
+        popularity = popularity or {}
+
+        def rank(i):
+            return (-popularity.get(self.names[i], 0), i)
 
-# 할인된 가격을 저장할 변수
-discounted_prices = {}
+        if not query:
+            return [self.names[i] for i in heapq.nsmallest(limit, range(len(self.names)), key=rank)]
+        prefix = self.prefix_matches(query)
+        results = [self.names[i] for i in heapq.nsmallest(limit, prefix, key=rank)]
+        if len(results) < limit:
+            infix = self.substring_matches(query) - prefix
+            results += [self.names[i] for i in heapq.nsmallest(limit - len(results), infix, key=rank)]
+        return results
 
-# 타임 슬립과 랜덤 유니폼 적용
-def random_sleep(min_sleep=3, max_sleep=5):
-    time.sleep(random.uniform(min_sleep, max_sleep))
+# 판매/입고된 수량 기준 아이템 인기도 (자동 완성 순위에 사용)
+item_popularity = Counter()
+
+# 대소문자, 공백, 기호를 무시하고 비교하기 위한 이름 정규화
+def normalize_name(name):
+    return re.sub(r'[^0-9a-z가-힣]', '', name.lower())
+
+# 카탈로그 항목: 분류(creature/item), 표시 이름, 별칭, 가격 반올림 규칙(nearest/adjust), 정렬 순서
+# (정렬 순서가 없는 항목은 순서가 있는 항목 뒤에 이름순으로 표시)
+UNORDERED = 1 << 30
+CatalogEntry = namedtuple('CatalogEntry', ['name', 'category', 'display_name', 'aliases', 'rounding', 'order'])
+
+def catalog_entry_from_doc(doc):
+    return CatalogEntry(
+        name=doc['name'],
+        category=doc.get('category', 'creature'),
+        display_name=doc.get('display_name') or doc['name'].title(),
+        aliases=tuple(doc.get('aliases', ())),
+        rounding=doc.get('rounding', 'nearest'),
+        order=doc.get('order', UNORDERED),
+    )
+
+def default_catalog_docs():
+    docs = [{'name': name, 'category': 'creature', 'display_name': name.title(), 'aliases': [], 'rounding': 'nearest', 'order': i}
+            for i, name in enumerate(DEFAULT_CREATURES)]
+    docs += [{'name': name, 'category': 'item', 'display_name': name.title(), 'aliases': [], 'rounding': 'adjust', 'order': i}
+             for i, name in enumerate(DEFAULT_ITEMS)]
+    return docs
+
+def sort_catalog_entries(entries):
+    return sorted(entries, key=lambda entry: (entry.order, entry.name))
+
+def catalog_version(entries):
+    return hash(tuple(sort_catalog_entries(entries)))
+
+# 카탈로그의 변경 불가능한 스냅샷 (카탈로그가 바뀌면 통째로 새 스냅샷으로 교체)
+class CatalogSnapshot:
+    def __init__(self, entries):
+        entries = sort_catalog_entries(entries)
+        self.entries = {entry.name: entry for entry in entries}
+        self.creatures = tuple(entry.name for entry in entries if entry.category == 'creature')
+        self.items = tuple(entry.name for entry in entries if entry.category == 'item')
+        self.index = CatalogIndex(self.creatures + self.items)
+        self.aliases = {}
+        for entry in entries:
+            for alias in (entry.name, entry.display_name) + entry.aliases:
+                self.aliases.setdefault(normalize_name(alias), entry.name)
+        self.version = hash(tuple(entries))
+
+    def __contains__(self, name):
+        return name in self.index
+
+    @property
+    def names(self):
+        return self.index.names
+
+    # 별칭이나 표시 이름을 실제 아이템 이름으로 변환 (없으면 None)
+    def resolve(self, name):
+        if name in self.index:
+            return name
+        return self.aliases.get(normalize_name(name))
+
+    def display_name(self, name):
+        entry = self.entries.get(name)
+        return entry.display_name if entry else name.title()
+
+catalog = CatalogSnapshot([catalog_entry_from_doc(doc) for doc in default_catalog_docs()])
 
 # 유저 에이전트와 추가 헤더 설정
 headers = {
@@ -71,111 +424,844 @@ def round_and_adjust(value):
 
     return float(adjusted_value)
 
-# 크리쳐 가격 정보를 웹 스크래핑하는 함수
-def fetch_creature_prices():
-    url = 'https://www.game.guide/creatures-of-sonaria-value-list'
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.text, 'html.parser')
+# values * scale을 Decimal과 같은 방식으로 정수 단위까지 반올림 (half_even이 아니면 ROUND_HALF_UP)
+# 곱셈 오차를 Dekker 분할로 정확히 구해서 .5 경계에서도 Decimal과 같은 결과를 냄
+def _split(values):
+    c = 134217729.0 * values  # 2**27 + 1
+    high = c - (c - values)
+    return high, values - high
+
+def _round_scaled(values, scale, half_even):
+    product = values * scale
+    values_high, values_low = _split(values)
+    scale_high, scale_low = _split(np.float64(scale))
+    error = ((values_high * scale_high - product) + values_high * scale_low + values_low * scale_high) + values_low * scale_low
+    base = np.floor(product)
+    distance = (product - base - 0.5) + error  # 실제 값 - (base + 0.5)의 부호가 정확함
+    if half_even:
+        return base + (distance > 0) + ((distance == 0) & (base % 2 == 1))
+    return base + (distance >= 0)
 
-        creature_data = []
+def _with_scalar_fallback(values, result, scalar_func):
+    # 음수는 int()/% 동작이 달라 기존 함수로 계산 (시세에서는 나오지 않음)
+    for i in np.flatnonzero(values < 0):
+        result[i] = scalar_func(float(values[i]))
+    return result
 
-        table = soup.find('table')
-        if not table:
-            print("Table not found in the web page.")
-            return creature_data
+# round_to_nearest를 배열 전체에 한 번에 적용 (결과는 round_to_nearest와 동일, NaN은 그대로 둠)
+def round_to_nearest_batch(values):
+    values = np.asarray(values, dtype=np.float64)
+    cents = _round_scaled(values, 100, half_even=True)
+    second_digit = cents % 10
+    keep_five = (second_digit > 2) & (second_digit <= 7)
+    result = (cents - second_digit + np.where(keep_five, 5, 0)) / 100
+    return _with_scalar_fallback(values, result, round_to_nearest)
 
-        rows = table.find_all('tr')[1:]
+# round_and_adjust를 배열 전체에 한 번에 적용 (결과는 round_and_adjust와 동일, NaN은 그대로 둠)
+def round_and_adjust_batch(values):
+    values = np.asarray(values, dtype=np.float64)
+    mills = _round_scaled(values, 1000, half_even=False)
+    third_digit = mills % 10
+    adjustment = np.select([third_digit <= 2, third_digit <= 4, third_digit <= 7], [0, 2, 5], 10)
+    result = (mills - third_digit + adjustment) / 1000
+    return _with_scalar_fallback(values, result, round_and_adjust)
 
-        for row in rows:
-            random_sleep()  # 각 요청 사이에 랜덤한 대기 시간 추가
-            cols = row.find_all('td')
-            if len(cols) >= 2:
-                name = cols[0].text.strip().lower()
-                value = cols[1].text.strip().lower()
+# 카탈로그 순서대로 시세를 담은 배열 테이블 ("N/A"는 NaN)
+class PriceTable:
+    def __init__(self, snapshot, prices):
+        self.names = snapshot.names
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.shoom = np.array([self.to_number(prices.get(name, {}).get('슘 시세')) for name in self.names], dtype=np.float64)
+        self.cash = np.array([self.to_number(prices.get(name, {}).get('현금 시세')) for name in self.names], dtype=np.float64)
+        self.creature_mask = np.array([snapshot.entries[name].category == 'creature' for name in self.names], dtype=bool)
+        self.adjust_mask = np.array([snapshot.entries[name].rounding == 'adjust' for name in self.names], dtype=bool)
 
-                if '~' in value:
-                    range_values = re.findall(r'\d+', value)
-                    if range_values:
-                        median_value = (int(range_values[0]) + int(range_values[1])) / 2
-                        value = f"{median_value}k"
+    @staticmethod
+    def to_number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+
+    # 아이템별 반올림 규칙(nearest/adjust)을 배열 단위로 적용
+    def round_by_rule(self, values, mask=None):
+        result = round_to_nearest_batch(values)
+        adjust = self.adjust_mask if mask is None else self.adjust_mask[mask]
+        if adjust.any():
+            result[adjust] = round_and_adjust_batch(values[adjust])
+        return result
+
+# 한 서버의 시세 테이블과 할인 프로필을 관리하고, 할인/환율 변환/반올림을 배열 단위로 계산
+# (같은 할인율의 결과는 시세가 바뀔 때까지 캐시)
+SELL_RATE = 0.0001
+
+class PricingEngine:
+    def __init__(self, prices):
+        self.prices = prices
+        self.table = None
+        self.profiles = {}  # 프로필 이름 -> 할인율
+        self.active = None  # 적용 중인 프로필 이름
+        self.discount_cache = {}  # 할인율 -> 할인된 현금 시세 배열
+        self.display_cache = {}  # 할인율 -> {아이템: 판매 메시지용 가격}
+
+    def invalidate(self):
+        self.table = None
+        self.discount_cache.clear()
+        self.display_cache.clear()
+
+    def get_table(self):
+        if self.table is None:
+            self.table = PriceTable(catalog, self.prices)
+        return self.table
+
+    def discounted_cash(self, percentage):
+        if percentage not in self.discount_cache:
+            table = self.get_table()
+            cash = table.cash.copy()
+            if percentage is not None:
+                mask = table.creature_mask
+                cash[mask] = table.round_by_rule(cash[mask] * (1 - (percentage / 100)), mask)
+            self.discount_cache[percentage] = cash
+        return self.discount_cache[percentage]
+
+    def set_profile(self, name, percentage):
+        self.profiles[name] = percentage
+        self.active = name
+
+    def load_profiles(self, profiles, active):
+        self.profiles = dict(profiles)
+        self.active = active if active in self.profiles else None
+
+    def active_percentage(self):
+        return None if self.active is None else self.profiles[self.active]
+
+    # 할인이 적용된 크리쳐 시세 (시세가 없는 크리쳐는 제외)
+    def discounted_creatures(self):
+        table = self.get_table()
+        cash = self.discounted_cash(self.active_percentage())
+        return {table.names[i]: float(cash[i]) for i in np.flatnonzero(table.creature_mask & ~np.isnan(cash))}
+
+    # 판매 메시지에 표시할 가격 (현금 시세 * 환율을 아이템별 규칙으로 반올림)
+    def display_prices(self):
+        percentage = self.active_percentage()
+        if percentage not in self.display_cache:
+            table = self.get_table()
+            values = table.round_by_rule(self.discounted_cash(percentage) * SELL_RATE)
+            self.display_cache[percentage] = {name: "N/A" if np.isnan(value) else float(value)
+                                              for name, value in zip(table.names, values)}
+        return self.display_cache[percentage]
+
+# 크리쳐 시세 페이지와 갱신 주기
+SCRAPE_URL = 'https://www.game.guide/creatures-of-sonaria-value-list'
+SCRAPE_INTERVAL_MINUTES = float(os.getenv('SCRAPE_INTERVAL_MINUTES', '60'))
+
+# 연결을 재사용하는 HTTP 세션 (봇 종료 시 닫음)
+http_session = None
 
-                creature_data.append({"name": name, "value": value})
+async def get_http_session():
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(headers=headers, timeout=aiohttp.ClientTimeout(total=30))
+    return http_session
 
+# ETag/Last-Modified로 조건부 요청을 보내고, 요청 사이에 랜덤 대기 시간을 두는 클라이언트
+class PoliteFetcher:
+    def __init__(self, min_sleep=3, max_sleep=5):
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.last_request = 0
+        self.cache = {}  # url -> (etag, last_modified, body)
+        self.lock = asyncio.Lock()
+
+    # 바뀐 내용이 있으면 (True, body), 304 응답이면 (False, 이전 body)를 반환
+    async def get(self, url):
+        async with self.lock:
+            wait = random.uniform(self.min_sleep, self.max_sleep) - (time.monotonic() - self.last_request)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            etag, last_modified, body = self.cache.get(url, (None, None, None))
+            request_headers = {}
+            if etag:
+                request_headers['If-None-Match'] = etag
+            if last_modified:
+                request_headers['If-Modified-Since'] = last_modified
+            session = await get_http_session()
+            try:
+                with metrics.timer('http_request_seconds', target='scrape'):
+                    async with session.get(url, headers=request_headers) as response:
+                        if response.status == 304 and body is not None:
+                            return False, body
+                        response.raise_for_status()
+                        body = await response.text()
+                        self.cache[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'), body)
+                        return True, body
+            finally:
+                self.last_request = time.monotonic()
+
+scrape_fetcher = PoliteFetcher()
+
+# 시세 표를 파싱하는 함수 (CPU 작업이므로 스레드에서 실행)
+def parse_creature_table(html):
+    # 스크래퍼에서만 쓰므로 시작 시간을 줄이기 위해 처음 파싱할 때 불러옴
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+
+    creature_data = []
+
+    table = soup.find('table')
+    if not table:
+        print("Table not found in the web page.")
         return creature_data
-    else:
+
+    rows = table.find_all('tr')[1:]
+
+    for row in rows:
+        cols = row.find_all('td')
+        if len(cols) >= 2:
+            name = cols[0].text.strip().lower()
+            value = cols[1].text.strip().lower()
+
+            if '~' in value:
+                range_values = re.findall(r'\d+', value)
+                if range_values:
+                    median_value = (int(range_values[0]) + int(range_values[1])) / 2
+                    value = f"{median_value}k"
+
+            creature_data.append({"name": name, "value": value})
+
+    return creature_data
+
+# 크리쳐 가격 정보를 웹 스크래핑하는 함수 (페이지가 바뀌지 않았으면 None 반환)
+# (executor를 주면 파싱을 그 실행기에서 처리: 워커에서는 프로세스 풀, 봇에서는 기본 스레드 풀)
+async def fetch_creature_prices(executor=None):
+    try:
+        changed, html = await scrape_fetcher.get(SCRAPE_URL)
+    except aiohttp.ClientError as e:
+        print(f'Error fetching creature prices: {e}')
         return []
+    if not changed:
+        return None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, parse_creature_table, html)
 
-# MongoDB 업데이트 함수
-def update_database(creature_data):
-    for creature in creature_data:
-        db.creatures.update_one({'name': creature['name']}, {'$set': {'shoom_price': creature['value']}}, upsert=True)
-    print("Database updated with the latest creature prices.")
+# MongoDB 업데이트 함수 (바뀐 크리쳐만 한 번의 bulk_write로 저장)
+async def update_database(creature_data):
+    if not creature_data:
+        return
+    operations = [UpdateOne({'name': creature['name']},
+                            {'$set': {'shoom_price': creature['value'], 'market_value': parse_market_value(creature['value'])}}, upsert=True)
+                  for creature in creature_data]
+    await creatures_collection.bulk_write(operations, ordered=False)
+    print(f"Database updated with the latest creature prices ({len(creature_data)} changed).")
+
+# 시세 이력: 시리즈(범위, 아이템)마다 마지막 값을 담은 문서 하나와 날짜별 버킷 문서(바뀐 시점의 값, 시가/고가/저가/종가)
+# (범위는 서버 id, 스크래핑한 시장 시세는 'market', 값은 숫자로 정규화하고 바뀌었을 때만 기록)
+# 시리즈 문서에는 마지막으로 바뀐 날까지의 날짜별 종가 창(closes)과 그날 기준 이동 평균(ma7, ma30)도 함께 갱신해 둠
+MARKET_SCOPE = 'market'
+PRICE_HISTORY_DAYS = 30
+MOVING_AVERAGE_WINDOWS = (7, 30)
+CLOSES_WINDOW = max(MOVING_AVERAGE_WINDOWS)
+
+def history_id(scope, item, day=None):
+    return f'{scope}:{item}' if day is None else f'{scope}:{item}:{day}'
+
+def days_between(start, end):
+    return (datetime.strptime(end, '%Y-%m-%d') - datetime.strptime(start, '%Y-%m-%d')).days
+
+# 마지막 종가 창을 day까지 이어 붙임 (바뀌지 않은 날은 그 전 값으로 채움)
+def extend_closes(series, day, value=None):
+    if not series or 'day' not in series:
+        return [] if value is None else [value]
+    closes = list(series.get('closes', []))
+    gap = days_between(series['day'], day)
+    if gap == 0:
+        if value is not None:
+            closes[-1] = value
+        return closes
+    closes.extend([series['value']] * min(gap - (value is not None), CLOSES_WINDOW))
+    if value is not None:
+        closes.append(value)
+    return closes[-CLOSES_WINDOW:]
+
+def moving_averages(closes):
+    return {f'ma{window}': sum(closes[-window:]) / len(closes[-window:]) for window in MOVING_AVERAGE_WINDOWS}
+
+def _record_price_changes(scope, values, timestamp):
+    collection = price_history_collection.collection
+    series = {doc['item']: doc for doc in collection.find({'_id': {'$in': [history_id(scope, item) for item in values]}},
+                                                          {'item': 1, 'value': 1, 'day': 1, 'closes': 1})}
+    last = {item: doc['value'] for item, doc in series.items()}
+    changed = {item: value for item, value in values.items() if last.get(item) != value}
+    if not changed:
+        return 0
+    day = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
+    operations = []
+    for item, value in changed.items():
+        # 그날 첫 변경이면 이전 값을 시가로 둠 (이력이 없으면 처음 값)
+        previous = last.get(item, value)
+        closes = extend_closes(series.get(item), day, value)
+        operations.append(UpdateOne({'_id': history_id(scope, item)}, {'$set': {
+            'kind': 'series', 'scope': scope, 'item': item, 'value': value, 'changed_at': timestamp,
+            'day': day, 'closes': closes, **moving_averages(closes)}}, upsert=True))
+        operations.append(UpdateOne({'_id': history_id(scope, item, day)}, {
+            '$setOnInsert': {'kind': 'day', 'scope': scope, 'item': item, 'day': day, 'open': previous},
+            '$push': {'points': {'t': timestamp, 'v': value}},
+            '$set': {'close': value},
+            '$max': {'high': max(previous, value)},
+            '$min': {'low': min(previous, value)},
+        }, upsert=True))
+    collection.bulk_write(operations, ordered=False)
+    return len(changed)
+
+async def record_price_changes(scope, values):
+    values = {item: value for item, value in values.items() if isinstance(value, (int, float)) and math.isfinite(value)}
+    if not values:
+        return 0
+    try:
+        return await price_history_collection.run(_record_price_changes, scope, values, time.time())
+    except Exception as e:
+        print(f'Error recording price history: {e}')
+        return 0
+
+# 최근 days일의 날짜별 (날짜, 시가, 고가, 저가, 종가), 바뀌지 않은 날은 전날 종가로 채움
+async def price_history(scope, item, days=PRICE_HISTORY_DAYS):
+    today = datetime.now()
+    start = (today - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    query = {'kind': 'day', 'scope': scope, 'item': item}
+    buckets = await price_history_collection.find_list({**query, 'day': {'$gte': start}}, {'points': 0}, sort=[('day', 1)])
+    before = await price_history_collection.find_one({**query, 'day': {'$lt': start}}, {'close': 1}, sort=[('day', -1)])
+    by_day = {bucket['day']: bucket for bucket in buckets}
+    last = before['close'] if before else None
+    rows = []
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).strftime('%Y-%m-%d')
+        bucket = by_day.get(day)
+        if bucket:
+            rows.append((day, bucket['open'], bucket['high'], bucket['low'], bucket['close']))
+            last = bucket['close']
+        elif last is not None:
+            rows.append((day, last, last, last, last))
+    return rows
+
+# 오늘 기준 이동 평균: 오늘 바뀐 시리즈는 저장된 값, 아니면 저장된 종가 창을 오늘까지 이어서 계산
+async def price_averages(scope, item):
+    series = await price_history_collection.find_one({'_id': history_id(scope, item)})
+    if not series or 'day' not in series:
+        return None
+    today = datetime.now().strftime('%Y-%m-%d')
+    if series['day'] == today:
+        return {f'ma{window}': series[f'ma{window}'] for window in MOVING_AVERAGE_WINDOWS}
+    return moving_averages(extend_closes(series, today))
+
+SPARK_LEVELS = '▁▂▃▄▅▆▇█'
+
+def sparkline(values):
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARK_LEVELS[3] * len(values)
+    return ''.join(SPARK_LEVELS[int((value - low) / (high - low) * (len(SPARK_LEVELS) - 1))] for value in values)
+
+def format_price_history(item, source, rows, averages):
+    if not rows:
+        return f'"{item}"의 {source} 시세 이력이 없습니다.'
+    closes = [row[4] for row in rows]
+    first, current = rows[0][1], closes[-1]
+    change = (current - first) / first * 100 if first else 0
+    lines = [
+        f'**{item}** {source} 시세 ({rows[0][0]} ~ {rows[-1][0]})',
+        f'`{sparkline(closes)}`',
+        f'현재: {current:,.0f}슘 ({change:+.1f}%)',
+        f'고가: {max(row[2] for row in rows):,.0f}슘 / 저가: {min(row[3] for row in rows):,.0f}슘',
+    ]
+    if averages:
+        lines.append(' / '.join(f"{window}일 평균: {averages[f'ma{window}']:,.0f}슘" for window in MOVING_AVERAGE_WINDOWS))
+    return '\n'.join(lines)
+
+# 마지막으로 저장된 크리쳐 시세 (이름 -> 값), 첫 실행 때 DB에서 불러옴
+scraped_prices = None
+
+# 시세를 한 번 가져와 바뀐 항목만 저장하고 바뀐 개수를 반환 (scrape 작업)
+async def scrape_once(executor=None):
+    global scraped_prices
+    if scraped_prices is None:
+        docs = await creatures_collection.find_list({}, {'name': 1, 'shoom_price': 1})
+        scraped_prices = {doc['name']: doc.get('shoom_price') for doc in docs}
+
+    creature_data = await fetch_creature_prices(executor)
+    if not creature_data:
+        return 0
+    changed = [creature for creature in creature_data if scraped_prices.get(creature['name']) != creature['value']]
+    await update_database(changed)
+    await record_price_changes(MARKET_SCOPE, {creature['name']: parse_market_value(creature['value']) for creature in changed})
+    scraped_prices.update((creature['name'], creature['value']) for creature in changed)
+    return len(changed)
+
+# 주기적으로 시세를 가져와 바뀐 항목만 저장하는 백그라운드 작업
+# (JOB_QUEUE가 켜져 있으면 워커에 맡기고 결과만 받음)
+@tasks.loop(minutes=SCRAPE_INTERVAL_MINUTES)
+async def refresh_creature_prices():
+    # 예외로 루프가 멈추지 않도록 한 번의 실패는 기록만 하고 다음 주기에 다시 시도
+    try:
+        result = await run_job('scrape')
+        if result['changed']:
+            price_service.expire()
+    except Exception as e:
+        print(f'Error refreshing creature prices: {e}')
 
 # Discord 봇 설정
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+
+# 서버 안에서만 슬래시 커맨드를 쓸 수 있도록 확인하는 커맨드 트리
+class ShopCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction):
+        # 자동 완성 요청도 여기를 거치지만 응답(defer)이 없으므로 커맨드로 집계하지 않음
+        if interaction.type is discord.InteractionType.autocomplete:
+            return interaction.guild_id is not None
+        # 커맨드 처리 시간과 그 사이의 DB 호출을 이 커맨드 이름으로 집계
+        command_name = interaction.command.name if interaction.command else 'unknown'
+        interaction.extras['started_at'] = time.perf_counter()
+        interaction.extras['command'] = command_name
+        interaction.extras['ephemeral'] = command_name in EPHEMERAL_COMMANDS
+        current_command.set(command_name)
+        if interaction.guild_id is None:
+            await interaction.response.send_message("이 명령어는 서버에서만 사용할 수 있습니다.", ephemeral=True)
+            return False
+        schedule_auto_defer(interaction)
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        if isinstance(error, app_commands.CheckFailure):
+            return
+        record_command(interaction, 'error')
+        await super().on_error(interaction, error)
+
+def record_command(interaction, status):
+    cancel_auto_defer(interaction)
+    started_at = interaction.extras.get('started_at')
+    if started_at is None:
+        return
+    command_name = interaction.extras['command']
+    metrics.observe('command_seconds', time.perf_counter() - started_at, command=command_name)
+    metrics.inc('commands_total', command=command_name, status=status)
+
+# 종료 시 아직 저장되지 않은 변경 사항을 모두 기록한 뒤 연결을 닫는 봇
+# (AutoShardedBot이므로 서버 수에 맞춰 샤드를 자동으로 나눔)
+class ShopBot(commands.AutoShardedBot):
+    # on_ready는 게이트웨이에 다시 연결될 때마다 호출되므로 초기화는 로그인 직후 한 번만 실행
+    async def setup_hook(self):
+        # bot.run은 Ctrl+C만 처리하므로 docker stop(SIGTERM)에도 close()로 남은 쓰기와 스냅샷을 저장하고 종료
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: run_in_background(self.close()))
+        except (NotImplementedError, RuntimeError):
+            pass
+        await startup()
+
+    async def close(self):
+        # SIGTERM 처리와 bot.run의 정리 과정에서 두 번 불릴 수 있으므로 한 번만 저장
+        if getattr(self, 'closing', False):
+            return await super().close()
+        self.closing = True
+        refresh_creature_prices.cancel()
+        monitor_loop_lag.cancel()
+        save_snapshot_periodically.cancel()
+        await flush_all_writers()
+        await sales_notifier.flush()
+        await save_snapshot()
+        if http_session is not None:
+            await http_session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await super().close()
+
+bot = ShopBot(command_prefix='!', intents=intents, tree_cls=ShopCommandTree)
+
+# 디스코드 메시지 한도: 본문 2000자, 메시지당 임베드 10개, 임베드 합계 6000자
+MESSAGE_LIMIT = 2000
+EMBEDS_PER_MESSAGE = 10
+EMBED_TOTAL_LIMIT = 6000
+
+# 본문을 줄 단위로 한도 안에 들어가게 나눔 (한 줄이 한도보다 길면 강제로 자름)
+def chunk_content(content, limit=MESSAGE_LIMIT):
+    chunks = []
+    current = ''
+    for line in content.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            chunks.append(current)
+            current = ''
+        current += line
+    if current:
+        chunks.append(current)
+    return chunks
+
+def chunk_embeds(embeds):
+    groups = []
+    current, size = [], 0
+    for embed in embeds:
+        if len(current) == EMBEDS_PER_MESSAGE or (current and size + len(embed) > EMBED_TOTAL_LIMIT):
+            groups.append(current)
+            current, size = [], 0
+        current.append(embed)
+        size += len(embed)
+    if current:
+        groups.append(current)
+    return groups
+
+# (이름, 값) 필드 목록을 임베드 하나의 한도(필드 25개, 6000자)에 맞춰 여러 임베드로 나눔
+# (여러 개로 나뉘면 제목 뒤에 번호를 붙이고, 메시지 단위 묶음은 chunk_embeds가 처리)
+EMBED_FIELD_LIMIT = 25
+EMBED_TITLE_SUFFIX_RESERVE = 12
+
+def field_embeds(title, color, fields):
+    pages, current, size = [], [], len(title) + EMBED_TITLE_SUFFIX_RESERVE
+    for name, value in fields:
+        field_size = len(name) + len(value)
+        if current and (len(current) == EMBED_FIELD_LIMIT or size + field_size > EMBED_TOTAL_LIMIT):
+            pages.append(current)
+            current, size = [], len(title) + EMBED_TITLE_SUFFIX_RESERVE
+        current.append((name, value))
+        size += field_size
+    if current or not pages:
+        pages.append(current)
+    embeds = []
+    for number, page in enumerate(pages, start=1):
+        embed = discord.Embed(title=title if len(pages) == 1 else f'{title} {number}/{len(pages)}', color=color)
+        for name, value in page:
+            embed.add_field(name=name, value=value, inline=True)
+        embeds.append(embed)
+    return embeds
+
+# 한도에 맞춘 (본문, 임베드 목록) 메시지 목록: 첫 임베드 묶음은 마지막 본문과 함께 보냄
+def split_message(content=None, embeds=None):
+    messages = [[text, []] for text in chunk_content(content)] if content else [[content, []]]
+    groups = chunk_embeds(embeds or [])
+    if groups:
+        messages[-1][1] = groups[0]
+        messages.extend([None, group] for group in groups[1:])
+    return messages
+
+# 토큰 버킷으로 라우트별 전송 속도를 제한 (디스코드가 429를 돌려주기 전에 미리 기다림)
+class RouteBucket:
+    def __init__(self, capacity, per):
+        self.capacity = capacity
+        self.per = per
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.per)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                metrics.inc('rate_limit_waits_total')
+                await asyncio.sleep((1 - self.tokens) * self.per / self.capacity)
+
+# 라우트 종류별 (요청 수, 초): 상호작용 후속 메시지는 웹훅, 로그 채널은 채널 메시지 한도를 따름
+ROUTE_LIMITS = {'interaction': (5, 2), 'channel': (5, 5)}
+MAX_TRACKED_ROUTES = 1000
+
+# 모든 봇 메시지 전송을 담당: 한도에 맞춰 나누고, 라우트별 속도를 지켜 순서대로 보냄
+class OutboundDispatcher:
+    def __init__(self):
+        self.buckets = OrderedDict()
+
+    def bucket(self, kind, key):
+        route = (kind, key)
+        if route not in self.buckets:
+            self.buckets[route] = RouteBucket(*ROUTE_LIMITS[kind])
+            if len(self.buckets) > MAX_TRACKED_ROUTES:
+                self.buckets.popitem(last=False)
+        self.buckets.move_to_end(route)
+        return self.buckets[route]
+
+    async def send(self, interaction, content=None, embeds=None, view=discord.utils.MISSING, ephemeral=False, file=discord.utils.MISSING):
+        messages = split_message(content, embeds)
+        cancel_auto_defer(interaction)
+        async with response_lock(interaction):
+            for i, (text, group) in enumerate(messages):
+                # 버튼과 첨부 파일은 마지막 메시지에 붙임
+                last = i == len(messages) - 1
+                message_view = view if last else discord.utils.MISSING
+                message_file = file if last else discord.utils.MISSING
+                if not interaction.response.is_done():
+                    observe_first_response(interaction)
+                    await interaction.response.send_message(text, embeds=group, view=message_view, ephemeral=ephemeral, file=message_file)
+                else:
+                    await self.bucket('interaction', interaction.id).acquire()
+                    await interaction.followup.send(text, embeds=group, view=message_view, ephemeral=ephemeral, file=message_file)
+                metrics.inc('outbound_messages_total', route='interaction')
+
+    # guild_id를 주면 그 서버의 채널일 때만 보냄 (다른 서버 채널로 내용이 새지 않도록)
+    async def send_channel(self, channel_id, content, guild_id=None):
+        channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+        if guild_id is not None and getattr(getattr(channel, 'guild', None), 'id', None) != guild_id:
+            metrics.inc('send_errors_total', reason='foreign_channel')
+            print(f'Channel {channel_id} does not belong to guild {guild_id}; message dropped')
+            return
+        for text, _ in split_message(content):
+            await self.bucket('channel', channel_id).acquire()
+            await channel.send(text)
+            metrics.inc('outbound_messages_total', route='channel')
+
+dispatcher = OutboundDispatcher()
+
+# 같은 상호작용에 대한 첫 응답(자동 defer 포함)이 동시에 나가지 않도록 하는 잠금
+def response_lock(interaction):
+    if 'response_lock' not in interaction.extras:
+        interaction.extras['response_lock'] = asyncio.Lock()
+    return interaction.extras['response_lock']
+
+# 커맨드가 AUTO_DEFER_SECONDS 안에 응답하지 못하면 먼저 defer해서 3초 만료를 피하고,
+# 이후 응답은 후속 메시지로 이어서 보냄
+AUTO_DEFER_SECONDS = float(os.getenv('AUTO_DEFER_SECONDS', '2'))
+# 본인에게만 보이게 응답하는 커맨드 (defer 뒤 첫 후속 메시지는 defer의 공개 여부를 따르므로 defer도 비공개로 해야 함)
+EPHEMERAL_COMMANDS = {'export', 'import', 'stats'}
+
+def schedule_auto_defer(interaction):
+    loop = asyncio.get_running_loop()
+    interaction.extras['defer_handle'] = loop.call_later(AUTO_DEFER_SECONDS, lambda: run_in_background(auto_defer(interaction)))
+
+def cancel_auto_defer(interaction):
+    handle = interaction.extras.pop('defer_handle', None)
+    if handle is not None:
+        handle.cancel()
+
+async def auto_defer(interaction):
+    async with response_lock(interaction):
+        if interaction.response.is_done():
+            return
+        observe_first_response(interaction)
+        metrics.inc('auto_defers_total', command=interaction.extras['command'])
+        try:
+            await interaction.response.defer(ephemeral=interaction.extras.get('ephemeral', False), thinking=True)
+        except discord.HTTPException as e:
+            print(f'Error deferring interaction: {e}')
 
 # 안전한 응답 함수: 상호작용이 이미 응답되었는지 확인
-async def safe_send(interaction, content=None, embeds=None):
+async def safe_send(interaction, content=None, embeds=None, view=discord.utils.MISSING, ephemeral=False, file=discord.utils.MISSING):
     try:
-        if embeds is None:
-            embeds = []
-        if not interaction.response.is_done():
-            await interaction.response.send_message(content, embeds=embeds)
-        else:
-            await interaction.followup.send(content, embeds=embeds)
+        await dispatcher.send(interaction, content, embeds, view, ephemeral, file)
     except discord.errors.NotFound:
+        metrics.inc('send_errors_total', reason='not_found')
         print("Interaction not found or already responded to.")
 
-async def fetch_prices_from_api():
-    url = 'http://localhost:5000/creature_prices'
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return []
+# 판매 알림처럼 몰려서 들어오는 알림을 서버별로 모아 SALES_LOG_DELAY초마다 한 번에 그 서버의 로그 채널로 보냄
+# (로그 채널은 /sales_log로 서버마다 설정, SALES_LOG_CHANNEL_ID는 그 채널이 있는 서버에만 쓰이는 기본값)
+SALES_LOG_CHANNEL_ID = int(os.getenv('SALES_LOG_CHANNEL_ID', '0'))
+SALES_LOG_DELAY = float(os.getenv('SALES_LOG_DELAY', '5'))
+
+class NotificationBatcher:
+    def __init__(self, default_channel_id, delay):
+        self.default_channel_id = default_channel_id
+        self.delay = delay
+        self.channels = {}  # guild_id -> 로그 채널 ID (0이면 보내지 않음)
+        self.pending = {}  # guild_id -> 보낼 줄 목록
+        self.task = None
+
+    def add(self, guild_id, line):
+        if self.channels.get(guild_id) == 0:
+            return
+        self.pending.setdefault(guild_id, []).append(line)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.flush_later())
+
+    def set_channel(self, guild_id, channel_id):
+        self.channels[guild_id] = channel_id or 0
+
+    async def channel_for(self, guild_id):
+        if guild_id not in self.channels:
+            settings = await settings_collection.find_one({'_id': guild_id}) or {}
+            self.channels[guild_id] = settings.get('sales_log_channel_id', self.default_channel_id) or 0
+        return self.channels[guild_id]
+
+    async def flush_later(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        for guild_id, lines in pending.items():
+            try:
+                channel_id = await self.channel_for(guild_id)
+                if channel_id:
+                    await dispatcher.send_channel(channel_id, '\n'.join(lines), guild_id)
+            except Exception as e:
+                metrics.inc('send_errors_total', reason='log_channel')
+                print(f'Error sending sales log for guild {guild_id}: {e}')
+
+sales_notifier = NotificationBatcher(SALES_LOG_CHANNEL_ID, SALES_LOG_DELAY)
+
+# 상호작용을 받은 뒤 첫 응답까지 걸린 시간 (3초를 넘기면 디스코드가 상호작용을 만료시킴)
+def observe_first_response(interaction):
+    started_at = interaction.extras.get('started_at')
+    if started_at is None:
+        return
+    elapsed = time.perf_counter() - started_at
+    command_name = interaction.extras['command']
+    metrics.observe('first_response_seconds', elapsed, command=command_name)
+    if elapsed > INTERACTION_DEADLINE:
+        metrics.inc('deadline_misses_total', command=command_name)
+
+# 시세 API 주소와 캐시 유지 시간(초): TTL이 지나면 이전 값을 주면서 백그라운드에서 갱신하고,
+# TTL + STALE이 지나면 갱신이 끝날 때까지 기다림
+PRICE_API_URL = os.getenv('PRICE_API_URL', 'http://localhost:5000/creature_prices')
+PRICE_CACHE_TTL = float(os.getenv('PRICE_CACHE_TTL', '300'))
+PRICE_CACHE_STALE = float(os.getenv('PRICE_CACHE_STALE', '3600'))
+
+# 이름으로 색인된 크리쳐 시세 캐시 (동시에 들어온 갱신 요청은 한 번의 조회로 합침)
+class PriceLookupService:
+    def __init__(self, ttl=PRICE_CACHE_TTL, stale=PRICE_CACHE_STALE):
+        self.ttl = ttl
+        self.stale = stale
+        self.index = {}
+        self.loaded_at = None
+        self.refresh_task = None
+
+    async def fetch_records(self):
+        try:
+            session = await get_http_session()
+            with metrics.timer('http_request_seconds', target='price_api'):
+                async with session.get(PRICE_API_URL) as response:
+                    response.raise_for_status()
+                    return await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # 로컬 API를 쓸 수 없으면 스크래퍼가 저장한 DB 값을 사용
+            print(f'Price API unavailable, falling back to database: {e}')
+            return await creatures_collection.find_list({}, {'_id': 0, 'name': 1, 'shoom_price': 1})
+
+    async def load(self):
+        try:
+            records = await self.fetch_records()
+            self.index = {normalize_name(record['name']): record for record in records}
+            self.loaded_at = time.monotonic()
+        except Exception as e:
+            print(f'Error refreshing price cache: {e}')
+
+    def refresh(self):
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.create_task(self.load())
+        return self.refresh_task
+
+    # 다음 조회 때 다시 불러오도록 캐시를 만료 처리
+    def expire(self):
+        if self.loaded_at is not None:
+            self.loaded_at = time.monotonic() - self.ttl
+
+    async def lookup(self, name):
+        age = None if self.loaded_at is None else time.monotonic() - self.loaded_at
+        if age is None or age > self.ttl + self.stale:
+            await asyncio.shield(self.refresh())
+        elif age > self.ttl:
+            self.refresh()
+
+        key = normalize_name(name)
+        record = self.index.get(key)
+        if record is None and catalog.resolve(name):
+            record = self.index.get(normalize_name(catalog.resolve(name)))
+        if record is None:
+            # 오타 등으로 정확히 일치하지 않으면 가장 비슷한 이름을 사용
+            matches = difflib.get_close_matches(key, self.index.keys(), n=1, cutoff=0.8)
+            if matches:
+                record = self.index[matches[0]]
+        return record
+
+price_service = PriceLookupService()
 
 @bot.event
 async def on_ready():
-    global inventory, prices
+    print(f'Logged in as {bot.user.name} - serving {len(bot.guilds)} guilds.')
+
+# 시작 순서: 로컬 스냅샷으로 바로 응답할 수 있게 만든 뒤, DB 연결/대조와 커맨드 동기화는 백그라운드에서 진행
+# 백그라운드 작업은 끝날 때까지 참조를 들고 있어야 중간에 가비지 컬렉션되지 않음
+background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def startup():
+    started = time.perf_counter()
+    snapshot = await asyncio.get_running_loop().run_in_executor(None, _read_snapshot)
+    if snapshot:
+        restore_snapshot(snapshot)
+    if not monitor_loop_lag.is_running():
+        monitor_loop_lag.start()
+    await start_metrics_server()
+    migration_event()
+    run_in_background(reconcile_with_database())
+    run_in_background(setup_slash_commands())
+    metrics.set('startup_seconds', time.perf_counter() - started)
+
+# 기존 데이터 이전이 끝났는지 (끝나기 전에 서버 상태를 DB에서 읽으면 이전 전의 빈 데이터를 캐시하고,
+# 그 사이 바꾼 시세가 이전될 문서와 겹치는 문서를 만듦), startup을 거치지 않는 CLI/워커에서는 None
+migration_done = None
+
+def migration_event():
+    global migration_done
+    if migration_done is None:
+        migration_done = asyncio.Event()
+    return migration_done
+
+async def reconcile_with_database():
     try:
-        inventory = load_inventory()
-        prices = load_prices()
-        print(f'Logged in as {bot.user.name} - Inventory and prices loaded.')
-        await setup_slash_commands()
+        await catalog_collection.run(_ping_database)
+        await load_catalog()
+        await migrate_legacy_documents()
+        migration_event().set()
+        await ensure_indexes()
+        for state in guild_states:
+            if state.warm:
+                await state.reconcile()
+        if SCRAPE_INTERVAL_MINUTES > 0 and not refresh_creature_prices.is_running():
+            refresh_creature_prices.start()
+        start_catalog_watcher()
+        if not save_snapshot_periodically.is_running():
+            save_snapshot_periodically.start()
     except Exception as e:
-        print(f'Error in on_ready: {e}')
+        print(f'Error during startup: {e}')
+    finally:
+        # 이전에 실패해도 명령이 영원히 기다리지 않도록 풀어 줌
+        migration_event().set()
+
+def _ping_database():
+    return get_client().admin.command('ping')
 
 @bot.command(name='price')
 async def fetch_price(ctx, *, creature_name: str):
-    prices = await fetch_prices_from_api()
-    for creature in prices:
-        if creature['name'] == creature_name.lower():
-            value = creature['shoom_price']
-            await ctx.send(f"{creature['name'].title()} - 중간값: {value}")
-            return
+    creature = await price_service.lookup(creature_name)
+    if creature:
+        value = creature['shoom_price']
+        await ctx.send(f"{creature['name'].title()} - 중간값: {value}")
+        return
     await ctx.send(f"Creature {creature_name} not found.")
 
 # 자동 완성 기능 구현
 async def autocomplete_items(interaction: discord.Interaction, current: str):
-    all_items = creatures + items
     # 최대 25개의 자동완성 옵션으로 제한
-    return [app_commands.Choice(name=item, value=item) for item in all_items if current.lower() in item.lower()][:25]
+    return [app_commands.Choice(name=item, value=item) for item in catalog.index.search(current, 25, item_popularity)]
 
 # 슬래시 커맨드: 아이템 추가
 @bot.tree.command(name='add', description='Add items to the inventory.')
 @app_commands.describe(item='The item to add', quantity='The quantity to add')
 @app_commands.autocomplete(item=autocomplete_items)
 async def add_item(interaction: discord.Interaction, item: str, quantity: int):
-    if item in creatures + items:
-        current_quantity = inventory.get(item, "N/A")
-        if current_quantity == "N/A":
-            inventory[item] = quantity
-        else:
-            inventory[item] = int(current_quantity) + quantity
-        save_inventory(inventory)
+    item = catalog.resolve(item) or item
+    if item in catalog:
+        state = await guild_states.get(interaction.guild_id)
+        await increment_stock(state, item, quantity)
         await safe_send(interaction, f'Item "{item}" added: {quantity} units.')
     else:
         await safe_send(interaction, f'Item "{item}" is not recognized.')
@@ -185,13 +1271,13 @@ async def add_item(interaction: discord.Interaction, item: str, quantity: int):
 @app_commands.describe(item='The item to remove', quantity='The quantity to remove')
 @app_commands.autocomplete(item=autocomplete_items)
 async def remove_item(interaction: discord.Interaction, item: str, quantity: int):
-    if item in creatures + items:
-        current_quantity = inventory.get(item, "N/A")
-        if current_quantity != "N/A" and int(current_quantity) >= quantity:
-            inventory[item] = int(current_quantity) - quantity
-            save_inventory(inventory)
+    item = catalog.resolve(item) or item
+    if item in catalog:
+        state = await guild_states.get(interaction.guild_id)
+        try:
+            await decrement_stock(state, item, quantity)
             await safe_send(interaction, f'Item "{item}" removed: {quantity} units.')
-        else:
+        except InsufficientStock:
             await safe_send(interaction, f'Not enough "{item}" in inventory.')
     else:
         await safe_send(interaction, f'Item "{item}" is not recognized.')
@@ -201,131 +1287,139 @@ async def remove_item(interaction: discord.Interaction, item: str, quantity: int
 @app_commands.describe(item='The item to update the price for', shoom_price='The new shoom price of the item')
 @app_commands.autocomplete(item=autocomplete_items)
 async def update_price(interaction: discord.Interaction, item: str, shoom_price: int):
-    global prices  # 전역 변수로 접근하여 업데이트
-    if item in creatures + items:
-        prices[item]["슘 시세"] = shoom_price
-        prices[item]["현금 시세"] = shoom_price * 0.7
-        save_prices(prices)
+    item = catalog.resolve(item) or item
+    if item in catalog:
+        state = await guild_states.get(interaction.guild_id)
+        state.prices[item] = {"슘 시세": shoom_price, "현금 시세": shoom_price * 0.7}
+        state.prices_writer.mark(item)
+        state.invalidate_prices(item)
         await safe_send(interaction, f'아이템 "{item}"의 시세가 슘 시세: {shoom_price}슘, 현금 시세: {shoom_price * 0.7}원으로 업데이트되었습니다.')
     else:
         await safe_send(interaction, f'아이템 "{item}"은(는) 사용할 수 없는 아이템입니다.')
 
-# 슬래시 커맨드: 현재 재고 확인
-@bot.tree.command(name='inventory', description='Show the current inventory with prices.')
-async def show_inventory(interaction: discord.Interaction):
-    embed1 = discord.Embed(title="현재 재고 목록 (Creatures Part 1)", color=discord.Color.blue())
-    embed2 = discord.Embed(title="현재 재고 목록 (Creatures Part 2)", color=discord.Color.blue())
-    embed3 = discord.Embed(title="현재 재고 목록 (Items)", color=discord.Color.green())
-
-    # Creatures 목록 추가 (첫 번째 임베드)
-    for item in creatures[:len(creatures)//2]:
-        quantity = inventory.get(item, "N/A")
-        prices_info = prices.get(item, {"슘 시세": "N/A", "현금 시세": "N/A"})
-        shoom_price = prices_info["슘 시세"]
-        cash_price = prices_info["현금 시세"]
-        embed1.add_field(name=item, value=f"재고: {quantity}개\n슘 시세: {shoom_price}슘\n현금 시세: {cash_price}원", inline=True)
+# 아이템별로 렌더링한 줄과 완성된 메시지를 보관하는 캐시
+# (재고/시세/할인가가 바뀐 아이템의 줄만 지우고, 완성된 메시지는 다음 요청 때 다시 조립)
+class RenderCache:
+    def __init__(self):
+        self.lines = {}  # 종류 -> {아이템: 렌더링 결과}
+        self.messages = {}  # 종류 -> 완성된 메시지
 
-    # Creatures 목록 추가 (두 번째 임베드)
-    for item in creatures[len(creatures)//2:]:
-        quantity = inventory.get(item, "N/A")
-        prices_info = prices.get(item, {"슘 시세": "N/A", "현금 시세": "N/A"})
-        shoom_price = prices_info["슘 시세"]
-        cash_price = prices_info["현금 시세"]
-        embed2.add_field(name=item, value=f"재고: {quantity}개\n슘 시세: {shoom_price}슘\n현금 시세: {cash_price}원", inline=True)
+    def line(self, kind, item, render):
+        lines = self.lines.setdefault(kind, {})
+        if item not in lines:
+            lines[item] = render(item)
+        return lines[item]
+
+    def message(self, kind, build):
+        if kind not in self.messages:
+            self.messages[kind] = build()
+        return self.messages[kind]
+
+    def invalidate(self, *items):
+        for lines in self.lines.values():
+            for item in items:
+                lines.pop(item, None)
+        self.messages.clear()
+
+    def invalidate_all(self):
+        self.lines.clear()
+        self.messages.clear()
 
-    # Items 목록 추가 (세 번째 임베드)
-    for item in items:
-        quantity = inventory.get(item, "N/A")
-        prices_info = prices.get(item, {"슘 시세": "N/A", "현금 시세": "N/A"})
+def build_inventory_embeds(state):
+    def render_inventory_field(item):
+        quantity = state.inventory.get(item, "N/A")
+        prices_info = state.prices.get(item, {"슘 시세": "N/A", "현금 시세": "N/A"})
         shoom_price = prices_info["슘 시세"]
         cash_price = prices_info["현금 시세"]
-        embed3.add_field(name=item, value=f"재고: {quantity}개\n슘 시세: {shoom_price}슘\n현금 시세: {cash_price}원", inline=True)
+        return f"재고: {quantity}개\n슘 시세: {shoom_price}슘\n현금 시세: {cash_price}원"
 
+    sections = [
+        ("현재 재고 목록 (Creatures)", discord.Color.blue(), catalog.creatures),
+        ("현재 재고 목록 (Items)", discord.Color.green(), catalog.items),
+    ]
+    embeds = []
+    for title, color, names in sections:
+        fields = [(item, state.render_cache.line('inventory', item, render_inventory_field)) for item in names]
+        embeds.extend(field_embeds(title, color, fields))
+    return embeds
+
+# 슬래시 커맨드: 현재 재고 확인
+@bot.tree.command(name='inventory', description='Show the current inventory with prices.')
+async def show_inventory(interaction: discord.Interaction):
+    state = await guild_states.get(interaction.guild_id)
     # 임베드 메시지를 디스코드에 전송
-    await safe_send(interaction, embeds=[embed1, embed2, embed3])
+    await safe_send(interaction, embeds=state.render_cache.message('inventory', lambda: build_inventory_embeds(state)))
 
 # 슬래시 커맨드: 할인 적용
 @bot.tree.command(name='discount', description='Apply a discount to all creatures.')
-@app_commands.describe(discount_percentage='The discount percentage to apply (0-100)')
-async def discount_creatures(interaction: discord.Interaction, discount_percentage: int):
-    global discounted_prices  # 전역 변수로 접근
+@app_commands.describe(discount_percentage='The discount percentage to apply (0-100)', profile='Name of the discount profile to save or re-apply')
+async def discount_creatures(interaction: discord.Interaction, discount_percentage: int = None, profile: str = 'default'):
+    state = await guild_states.get(interaction.guild_id)
+    if discount_percentage is None:
+        # 할인율 없이 호출하면 저장된 프로필을 다시 적용
+        discount_percentage = state.pricing.profiles.get(profile)
+        if discount_percentage is None:
+            await safe_send(interaction, f'할인 프로필 "{profile}"이(가) 없습니다.')
+            return
     if 0 <= discount_percentage <= 100:
-        discount_factor = 1 - (discount_percentage / 100)
-        discounted_prices = {}
-        for creature in creatures:
-            if creature in prices:
-                original_price = float(prices[creature]["현금 시세"])
-                discounted_price = round_to_nearest(original_price * discount_factor)
-                discounted_prices[creature] = discounted_price
+        state.pricing.set_profile(profile, discount_percentage)
+        state.render_cache.invalidate(*catalog.creatures)
+        await save_discount_profiles(interaction.guild_id, state.pricing)
 
         # 결과 메시지 구성
         discount_message = "할인이 적용된 시세:\n"
-        for creature, price in discounted_prices.items():
-            discount_message += f"• {creature.title()} - 할인된 시세: {price}원\n"
+        for creature, price in state.pricing.discounted_creatures().items():
+            discount_message += f"• {catalog.display_name(creature)} - 할인된 시세: {price}원\n"
 
         await safe_send(interaction, discount_message)
     else:
         await safe_send(interaction, "할인율은 0과 100 사이의 값이어야 합니다.")
 
+def build_sell_message(state):
+    # 서버의 할인 프로필이 반영된 가격을 한 번에 계산해 두고 바뀐 아이템 줄만 다시 렌더링
+    display_prices = state.pricing.display_prices()
+
+    def render_sell_line(item):
+        quantity = state.inventory.get(item, 0)  # inventory에서 최신 정보 가져오기
+        return f"• {catalog.display_name(item)} {display_prices.get(item, 'N/A')} (재고 {quantity})\n"
+
+    render_cache = state.render_cache
+    rate_message = "슘 1K당 0.07\n"  # 새로운 환율 정보
+    parts = ["ㅡㅡ소나리아ㅡㅡ\n\n계좌로 팔아요!!\n\n", rate_message, "<크리쳐>\n"]
+    parts += [render_cache.line('sell', item, render_sell_line) for item in catalog.creatures]
+    parts.append("\n<아이템>\n")
+    parts += [render_cache.line('sell', item, render_sell_line) for item in catalog.items]
+    # 필수 메시지 추가
+    parts.append("\n• 문상 X  계좌 O\n• 구매를 원하시면 갠으로! \n• 재고 확인 후 갠오세요!")
+    return "".join(parts)
+
 # 슬래시 커맨드: 판매 메시지 생성
 @bot.tree.command(name='sell_message', description='Generate the sell message.')
 async def sell_message(interaction: discord.Interaction):
     """판매 메시지를 생성합니다."""
-    rate_message = "슘 1K당 0.07\n"  # 새로운 환율 정보
-    creatures_message = "ㅡㅡ소나리아ㅡㅡ\n\n계좌로 팔아요!!\n\n" + rate_message + "<크리쳐>\n"
-
-    # 크리처 목록을 순회하면서 메시지 구성
-    for item in creatures:
-        quantity = inventory.get(item, 0)  # inventory에서 최신 정보 가져오기
-        prices_info = prices.get(item, {"현금 시세": "N/A"})
-        cash_price = discounted_prices.get(item, prices_info["현금 시세"])  # 할인된 가격 사용
-        if cash_price != "N/A":
-            display_price = round_to_nearest(float(cash_price) * 0.0001)  # 수정된 반올림 함수 적용
-        else:
-            display_price = "N/A"
-        creatures_message += f"• {item.title()} {display_price} (재고 {quantity})\n"
-
-    # 아이템 목록 메시지 구성
-    items_message = "\n<아이템>\n"
-    for item in items:
-        quantity = inventory.get(item, 0)  # inventory에서 최신 정보 가져오기
-        prices_info = prices.get(item, {"현금 시세": "N/A"})
-        cash_price = prices_info["현금 시세"]
-        if cash_price != "N/A":
-            display_price = round_and_adjust(float(cash_price) * 0.0001)  # 소수점 네 번째 자리 반올림 및 조정 적용
-        else:
-            display_price = "N/A"
-        items_message += f"• {item.title()} {display_price} (재고 {quantity})\n"
-
-    # 필수 메시지 추가
-    final_message = creatures_message + items_message + "\n• 문상 X  계좌 O\n• 구매를 원하시면 갠으로! \n• 재고 확인 후 갠오세요!"
-
-    await safe_send(interaction, final_message)
-
-# 슬래시 커맨드: 구매 메시지 생성
-@bot.tree.command(name='buy_message', description='Generate the buy message.')
-async def buy_message(interaction: discord.Interaction):
-    """구매 메시지를 생성합니다."""
-    # 필수 문장 추가
-    buy_message_content = "ㅡㅡ소나리아ㅡㅡ\n\n"  # 필수 문장
+    state = await guild_states.get(interaction.guild_id)
+    await safe_send(interaction, state.render_cache.message('sell', lambda: build_sell_message(state)))
 
+def build_buy_message(state):
     # 재고가 0~1 사이인 크리쳐 목록 추가
     creature_lines = []
-    for item in creatures:
-        quantity = inventory.get(item, 0)
+    for item in catalog.creatures:
+        quantity = state.inventory.get(item, 0)
         if quantity != "N/A" and 0 <= int(quantity) <= 1:
-            creature_lines.append(item.title())  # 재고가 0~1 사이인 크리쳐만 추가
+            creature_lines.append(catalog.display_name(item))  # 재고가 0~1 사이인 크리쳐만 추가
 
     # 두 개씩 묶어 한 줄에 추가
-    for i in range(0, len(creature_lines), 2):
-        line = ", ".join(creature_lines[i:i + 2])
-        buy_message_content += f"{line}\n"
+    lines = [", ".join(creature_lines[i:i + 2]) + "\n" for i in range(0, len(creature_lines), 2)]
 
     # 필수 문장 추가
-    buy_message_content += "\n슘으로 구합니다\n정가 정도에 다 삽니다\n갠으로 제시 주세요"
+    return "ㅡㅡ소나리아ㅡㅡ\n\n" + "".join(lines) + "\n슘으로 구합니다\n정가 정도에 다 삽니다\n갠으로 제시 주세요"
 
-    # 최종 메시지 전송
-    await safe_send(interaction, buy_message_content)
+# 슬래시 커맨드: 구매 메시지 생성
+@bot.tree.command(name='buy_message', description='Generate the buy message.')
+async def buy_message(interaction: discord.Interaction):
+    """구매 메시지를 생성합니다."""
+    state = await guild_states.get(interaction.guild_id)
+    await safe_send(interaction, state.render_cache.message('buy', lambda: build_buy_message(state)))
 
 # 슬래시 커맨드: 판매 기록 저장 및 인벤토리 업데이트
 @bot.tree.command(name='판매', description='상품을 판매합니다.')
@@ -345,18 +1439,19 @@ async def sell_item(interaction: discord.Interaction, amount: int, buyer_name: s
     if item_name5 and quantity5 > 0:
         items_sold.append((item_name5, quantity5))
 
-    # 재고 업데이트 및 판매 내역 기록
-    if items_sold:
-        for item, quantity in items_sold:
-            current_quantity = inventory.get(item, 0)
-            if current_quantity < quantity:
-                await safe_send(interaction, f"재고가 부족하여 {item}을(를) {quantity}개 판매할 수 없습니다.")
-                return
-            inventory[item] -= quantity
-        save_inventory(inventory)
+    # 다른 커맨드와 같이 별칭/표시 이름을 카탈로그 이름으로 바꾸고, 모르는 아이템이면 재고를 건드리지 않고 알림
+    resolved = []
+    for item, quantity in items_sold:
+        name = catalog.resolve(item) or item
+        if name not in catalog:
+            await safe_send(interaction, f'아이템 "{item}"은(는) 사용할 수 없는 아이템입니다.')
+            return
+        resolved.append((name, quantity))
+    items_sold = resolved
 
     # 판매 내역을 통합하여 저장
     sale_record = {
+        "guild_id": interaction.guild_id,
         "amount": amount,
         "buyer_name": buyer_name,
         "items_sold": items_sold,
@@ -364,124 +1459,1473 @@ async def sell_item(interaction: discord.Interaction, amount: int, buyer_name: s
         "user_id": interaction.user.id,  # 사용자 ID 저장
         "user_display_name": interaction.user.display_name  # 사용자 이름 저장
     }
-    sales_collection.insert_one(sale_record)
+
+    # 재고 차감과 판매 기록 저장을 한 번에 처리 (재고가 부족하면 아무것도 반영되지 않음)
+    state = await guild_states.get(interaction.guild_id)
+    try:
+        await record_sale(state, items_sold, sale_record)
+    except InsufficientStock as e:
+        await safe_send(interaction, f"재고가 부족하여 {e.item}을(를) {e.quantity}개 판매할 수 없습니다.")
+        return
 
     await safe_send(interaction, f"상품이 판매되었습니다! 총액: {amount}원")
+    sales_notifier.add(interaction.guild_id, format_sale_line(sale_record))
+
+# 판매 내역 한 건을 한 줄로 표시
+def format_sale_line(record):
+    items_detail = ", ".join([f"{item} - {quantity}개" for item, quantity in record.get("items_sold", [])])
+    if record.get('type') == REVERSAL:
+        return f"[취소] {record.get('user_display_name', '알 수 없음')}: {items_detail} - {record.get('amount', '알 수 없음')}원 (취소된 판매 ID: {record['sale_id']})"
+    return f"{record.get('user_display_name', '알 수 없음')}: {items_detail} - {record.get('amount', '알 수 없음')}원 - 구매자: {record.get('buyer_name', '알 수 없음')} (판매 ID: {record['_id']})"
+
+# 판매 내역 메시지 구성: 유저별 합계 (+ 정산 기간 합계, 판매 속도) + 현재 페이지의 상세 기록
+# 버튼은 한 메시지에만 붙일 수 있으므로 판매 내역 한 페이지는 항상 메시지 하나에 들어가야 함
+# (유저별 합계는 상위 SALES_SUMMARY_LIMIT명과 나머지 합계만, 기록 줄은 남은 길이에 맞춰 판매 ID는 남기고 자름)
+SALES_SUMMARY_LIMIT = 10
+SUMMARY_LINE_LIMIT = 80
+SALE_ID_SUFFIX_LENGTH = len(" (판매 ID: 000000000000000000000000)")
+
+def shorten(text, limit, keep_end=0):
+    if len(text) <= limit:
+        return text
+    return text[:max(limit - keep_end - 1, 0)] + '…' + (text[-keep_end:] if keep_end else '')
+
+def build_sales_message(summary, records, page_number, header=None):
+    lines = list(header or [])
+    lines.append("유저별 판매 합계:")
+    for row in summary[:SALES_SUMMARY_LIMIT]:
+        lines.append(shorten(f"• {row['name']}: {row['count']}건, 총 판매액: {row['total']}원", SUMMARY_LINE_LIMIT))
+    rest = summary[SALES_SUMMARY_LIMIT:]
+    if rest:
+        lines.append(f"• 외 {len(rest)}명: {sum(row['count'] for row in rest)}건, 총 판매액: {sum(row['total'] for row in rest)}원")
+    lines.append(f"\n판매 기록 ({page_number}페이지):")
+    if records:
+        width = (MESSAGE_LIMIT - len("\n".join(lines))) // len(records) - 1
+        lines.extend(shorten(format_sale_line(record), width, SALE_ID_SUFFIX_LENGTH) for record in records)
+    return "\n".join(lines)
+
+# 이전/다음 버튼으로 판매 내역을 페이지 단위로 넘겨보는 뷰
+class SalesHistoryView(discord.ui.View):
+    def __init__(self, match, summary, header=None):
+        super().__init__(timeout=300)
+        self.match = match
+        self.summary = summary
+        self.header = header
+        self.page_keys = [None]  # 각 페이지를 시작한 커서 위치
+        self.records = []
+        self.has_next = False
+
+    async def load_page(self):
+        self.records, self.has_next = await fetch_sales_page(self.match, self.page_keys[-1])
+        self.previous_page.disabled = len(self.page_keys) == 1
+        self.next_page.disabled = not self.has_next
+
+    def render(self):
+        return build_sales_message(self.summary, self.records, len(self.page_keys), self.header)
+
+    @discord.ui.button(label='이전', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if len(self.page_keys) > 1:
+            self.page_keys.pop()
+        await self.load_page()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    @discord.ui.button(label='다음', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.has_next:
+            last = self.records[-1]
+            self.page_keys.append((last['timestamp'], last['_id']))
+        await self.load_page()
+        await interaction.response.edit_message(content=self.render(), view=self)
 
 # 슬래시 커맨드: 모든 유저의 판매 내역 확인
 @bot.tree.command(name='판매내역', description='모든 유저의 판매 내역을 확인합니다.')
-async def show_sales(interaction: discord.Interaction):
-    all_sales_records = list(sales_collection.find().sort("timestamp", 1))
-    if len(all_sales_records) == 0:  # 판매 내역이 없을 경우
-        await safe_send(interaction, "판매 기록이 없습니다.")
+@app_commands.describe(start_date='시작 날짜 (YYYY-MM-DD)', end_date='종료 날짜 (YYYY-MM-DD)')
+async def show_sales(interaction: discord.Interaction, start_date: str = None, end_date: str = None):
+    try:
+        date_filter = sales_date_filter(start_date, end_date)
+    except ValueError:
+        await safe_send(interaction, "날짜는 YYYY-MM-DD 형식으로 입력해야 합니다.")
         return
 
-    user_sales = {}
-    for record in all_sales_records:
-        user_id = record.get("user_id")
-        user_display_name = record.get("user_display_name", "알 수 없음")
-        if user_display_name not in user_sales:
-            user_sales[user_display_name] = []
-        
-        items_detail = ", ".join([f"{item} - {quantity}개" for item, quantity in record.get("items_sold", [])])
-        sales_info = f"{items_detail} - {record.get('amount', '알 수 없음')}원 - 구매자: {record.get('buyer_name', '알 수 없음')} (판매 ID: {record['_id']})"
-        user_sales[user_display_name].append(sales_info)
-    
-    final_message = ""
-    for user, sales in user_sales.items():
-        total_sales = sum(int(re.search(r"(\d+)원", sale).group(1)) for sale in sales if re.search(r"(\d+)원", sale))
-        final_message += f"{user}님의 판매 기록:\n\n"
-        final_message += "\n".join(sales)
-        final_message += f"\n\n총 판매액: {total_sales}원\n\n"
+    guild_id = interaction.guild_id
+    header = None
+    if date_filter:
+        # 날짜 범위는 원장에서 집계
+        match = {'guild_id': guild_id, 'type': {'$in': [SALE, REVERSAL]}, **date_filter}
+        summary = await sales_summary(match)
+    else:
+        # 기본은 현재 정산 기간: 합계는 롤업 문서에서 바로 읽음
+        period = await current_period(guild_id)
+        match = {'guild_id': guild_id, 'period': period, 'type': {'$in': [SALE, REVERSAL]}}
+        summary = await period_user_summary(guild_id, period)
+        totals = await period_totals(guild_id, period)
+        velocity = await item_velocity(guild_id)
+        header = [f"정산 기간 #{period + 1}: {totals['count']}건, 총 판매액: {totals['total']}원"]
+        if velocity:
+            top = sorted(velocity.items(), key=lambda pair: -pair[1])[:5]
+            header.append(f"최근 {SALES_VELOCITY_DAYS}일 판매 속도: " + ", ".join(f"{item} {rate:.1f}개/일" for item, rate in top))
+        header.append("")
+    if not summary:  # 판매 내역이 없을 경우
+        await safe_send(interaction, "판매 기록이 없습니다.")
+        return
 
-    await safe_send(interaction, final_message)
+    view = SalesHistoryView(match, summary, header)
+    await view.load_page()
+    await safe_send(interaction, view.render(), view=view)
 
 # 슬래시 커맨드: 특정 판매 기록 삭제 및 인벤토리 복구 (어드민 전용)
-@bot.tree.command(name='판매삭제', description='특정 판매 기록을 삭제하고, 인벤토리를 복구합니다.')
-@app_commands.describe(sale_id='삭제할 판매 기록의 ID')
+@bot.tree.command(name='판매삭제', description='특정 판매를 취소 처리하고, 인벤토리를 복구합니다.')
+@app_commands.describe(sale_id='취소할 판매 기록의 ID')
 async def delete_sale(interaction: discord.Interaction, sale_id: str):
     if interaction.user.guild_permissions.administrator:
         try:
-            # 판매 기록을 조회하여 인벤토리 복구에 필요한 정보 획득
-            sale_record = sales_collection.find_one({"_id": ObjectId(sale_id)})
+            # 취소 이벤트 기록과 인벤토리 복구를 한 번에 처리 (원래 판매 기록은 남음)
+            state = await guild_states.get(interaction.guild_id)
+            sale_record = await cancel_sale(state, sale_id)
             if sale_record:
-                # 인벤토리 복구
-                items_sold = sale_record.get("items_sold", [])
-                for item, quantity in items_sold:
-                    current_quantity = inventory.get(item, 0)
-                    inventory[item] = current_quantity + quantity
-                save_inventory(inventory)
-
-                # 판매 기록 삭제
-                sales_collection.delete_one({"_id": ObjectId(sale_id)})
-                await safe_send(interaction, f"판매 기록(ID: {sale_id})이 성공적으로 삭제되고, 인벤토리가 복구되었습니다.")
+                await safe_send(interaction, f"판매 기록(ID: {sale_id})이 취소 처리되고, 인벤토리가 복구되었습니다.")
             else:
-                await safe_send(interaction, f"판매 기록(ID: {sale_id})을 찾을 수 없습니다.")
+                await safe_send(interaction, f"판매 기록(ID: {sale_id})을 찾을 수 없거나 이미 취소되었습니다.")
         except Exception as e:
             await safe_send(interaction, f"오류가 발생했습니다: {str(e)}")
     else:
         await safe_send(interaction, "이 명령어를 사용할 권한이 없습니다.", ephemeral=True)
 
-# 슬래시 커맨드: 판매 내역 초기화 (정산, 어드민 전용)
-@bot.tree.command(name='정산', description='판매 내역을 초기화합니다.')
+# 슬래시 커맨드: 정산 (현재 정산 기간을 닫고 새 기간 시작, 어드민 전용)
+@bot.tree.command(name='정산', description='현재 정산 기간을 마감하고 새 기간을 시작합니다.')
 async def reset_sales(interaction: discord.Interaction):
     # 관리자 권한 확인 (예: 'ADMINISTRATOR' 권한이 있는 경우)
     if interaction.user.guild_permissions.administrator:
-        sales_collection.delete_many({})  # 모든 판매 기록 삭제
-        await safe_send(interaction, "판매 내역이 초기화되었습니다.")
+        # 기록은 지우지 않고 정산 이벤트를 남김
+        settlement = await settle_sales(interaction.guild_id, interaction.user.id)
+        await safe_send(interaction, f"정산 기간 #{settlement['period'] + 1}이 마감되었습니다. ({settlement['count']}건, 총 판매액: {settlement['total']}원)")
+    else:
+        await safe_send(interaction, "이 명령어를 사용할 권한이 없습니다.", ephemeral=True)
+
+# 슬래시 커맨드: 판매/재고/시세를 gzip 파일로 내보내기 (어드민 전용)
+DATA_KIND_CHOICES = [app_commands.Choice(name=kind, value=kind) for kind in ('sales', 'inventory', 'prices')]
+FILE_FORMAT_CHOICES = [app_commands.Choice(name=file_format, value=file_format) for file_format in ('csv', 'jsonl')]
+DEFAULT_UPLOAD_LIMIT = 25 * 1024 * 1024
+
+@bot.tree.command(name='export', description='Export sales, inventory or prices as a gzip file.')
+@app_commands.describe(kind='Data to export', file_format='File format')
+@app_commands.choices(kind=DATA_KIND_CHOICES, file_format=FILE_FORMAT_CHOICES)
+async def export_data(interaction: discord.Interaction, kind: str, file_format: str = 'csv'):
+    if not interaction.user.guild_permissions.administrator:
+        await safe_send(interaction, "이 명령어를 사용할 권한이 없습니다.", ephemeral=True)
+        return
+    try:
+        result = await run_job('export', {'kind': kind, 'guild_id': interaction.guild_id, 'file_format': file_format})
+    except (JobFailed, asyncio.TimeoutError) as e:
+        await safe_send(interaction, f"내보내기에 실패했습니다: {e}", ephemeral=True)
+        return
+    path, count = result['path'], result['count']
+    try:
+        guild = getattr(interaction, 'guild', None)
+        upload_limit = guild.filesize_limit if guild else DEFAULT_UPLOAD_LIMIT
+        if os.path.getsize(path) > upload_limit:
+            await safe_send(interaction, f"내보낸 파일({count}건)이 첨부 한도보다 큽니다. `python discordbot.py export`를 사용하세요.", ephemeral=True)
+            return
+        with open(path, 'rb') as f:
+            await safe_send(interaction, f"{kind} {count}건을 내보냈습니다.", ephemeral=True, file=discord.File(f, filename=result['filename']))
+    finally:
+        os.remove(path)
+
+# 슬래시 커맨드: 마지막으로 수집한 시장 시세를 이 서버의 크리쳐 시세에 반영 (어드민 전용)
+@bot.tree.command(name='reprice', description='Apply the latest scraped market prices to creature prices.')
+async def reprice(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await safe_send(interaction, "이 명령어를 사용할 권한이 없습니다.", ephemeral=True)
+        return
+    try:
+        result = await run_job('reprice', {'guild_id': interaction.guild_id})
+    except (JobFailed, asyncio.TimeoutError) as e:
+        await safe_send(interaction, f"시세 반영에 실패했습니다: {e}", ephemeral=True)
+        return
+    state = await guild_states.get(interaction.guild_id)
+    await state.reload()
+    await safe_send(interaction, f"크리쳐 {result['updated']}개의 시세를 시장 시세로 갱신했습니다.")
+
+# 슬래시 커맨드: 이 서버의 판매 알림을 보낼 채널 설정 (채널을 비우면 알림 끔, 어드민 전용)
+@bot.tree.command(name='sales_log', description='Set the channel that receives sale notifications for this server.')
+@app_commands.describe(channel='Channel for sale notifications (leave empty to turn them off)')
+async def set_sales_log(interaction: discord.Interaction, channel: discord.TextChannel = None):
+    if not interaction.user.guild_permissions.administrator:
+        await safe_send(interaction, "이 명령어를 사용할 권한이 없습니다.", ephemeral=True)
+        return
+    channel_id = channel.id if channel else 0
+    await settings_collection.update_one({'_id': interaction.guild_id}, {'$set': {'sales_log_channel_id': channel_id}}, upsert=True)
+    sales_notifier.set_channel(interaction.guild_id, channel_id)
+    await safe_send(interaction, f"판매 알림을 {channel.mention}에 보냅니다." if channel else "판매 알림을 끕니다.")
+
+# 슬래시 커맨드: 서버 시세 또는 시장 시세의 최근 추이
+PRICE_SOURCE_CHOICES = [app_commands.Choice(name='server', value='server'), app_commands.Choice(name='market', value='market')]
+
+@bot.tree.command(name='price_history', description='Show the recent price trend of an item.')
+@app_commands.describe(item='The item to show', days='Number of days to show', source='Server prices or scraped market prices')
+@app_commands.choices(source=PRICE_SOURCE_CHOICES)
+@app_commands.autocomplete(item=autocomplete_items)
+async def show_price_history(interaction: discord.Interaction, item: str, days: app_commands.Range[int, 1, 90] = PRICE_HISTORY_DAYS,
+                             source: str = 'server'):
+    item = catalog.resolve(item) or item
+    if item not in catalog:
+        await safe_send(interaction, f'아이템 "{item}"은(는) 사용할 수 없는 아이템입니다.')
+        return
+    scope = MARKET_SCOPE if source == 'market' else interaction.guild_id
+    rows = await price_history(scope, item, days)
+    averages = await price_averages(scope, item)
+    await safe_send(interaction, format_price_history(item, '시장' if source == 'market' else '서버', rows, averages))
+
+# 슬래시 커맨드: CSV/JSONL(.gz 가능) 파일에서 판매/재고/시세 가져오기 (어드민 전용)
+@bot.tree.command(name='import', description='Import sales, inventory or prices from a CSV/JSONL file.')
+@app_commands.describe(kind='Data to import', file='CSV or JSONL file, optionally gzip compressed')
+@app_commands.choices(kind=DATA_KIND_CHOICES)
+async def import_data(interaction: discord.Interaction, kind: str, file: discord.Attachment):
+    if not interaction.user.guild_permissions.administrator:
+        await safe_send(interaction, "이 명령어를 사용할 권한이 없습니다.", ephemeral=True)
+        return
+    try:
+        file_format, compressed = detect_file_format(file.filename)
+    except ValueError as e:
+        await safe_send(interaction, str(e), ephemeral=True)
+        return
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        await file.save(path)
+        state = await guild_states.get(interaction.guild_id)
+        count, written = await import_records(state, kind, path, file_format, compressed)
+        await safe_send(interaction, f"{kind} {count}건을 확인하고 {written}건을 반영했습니다.", ephemeral=True)
+    except ImportValidationError as e:
+        await safe_send(interaction, "가져오기를 취소했습니다. 잘못된 행:\n" + "\n".join(e.errors), ephemeral=True)
+    finally:
+        os.remove(path)
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    record_command(interaction, 'ok')
+
+# 이벤트 루프 지연 측정: 1초 동안 잠든 뒤 예정보다 늦게 깨어난 시간을 기록
+LOOP_LAG_INTERVAL = 1
+
+@tasks.loop(seconds=LOOP_LAG_INTERVAL)
+async def monitor_loop_lag():
+    start = time.perf_counter()
+    await asyncio.sleep(LOOP_LAG_INTERVAL)
+    lag = max(time.perf_counter() - start - LOOP_LAG_INTERVAL, 0)
+    metrics.observe('event_loop_lag_seconds', lag)
+    metrics.set('event_loop_lag_last_seconds', lag)
+
+# METRICS_PORT가 설정되면 /metrics 에서 Prometheus 형식으로 지표를 내보냄 (0 또는 미설정이면 끔)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+metrics_runner = None
+
+async def handle_metrics(request):
+    from aiohttp import web
+    metrics.set('cached_guilds', len(guild_states))
+    return web.Response(text=metrics.render_prometheus(), content_type='text/plain')
+
+async def start_metrics_server():
+    global metrics_runner
+    if METRICS_PORT <= 0 or metrics_runner is not None:
+        return
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    metrics_runner = web.AppRunner(app)
+    await metrics_runner.setup()
+    await web.TCPSite(metrics_runner, '0.0.0.0', METRICS_PORT).start()
+    print(f'Metrics endpoint listening on port {METRICS_PORT}')
+
+# 커맨드별 처리 수, p50/p99 지연 시간, 커맨드당 DB 호출 수 요약
+def format_stats():
+    lines = ['커맨드 | 호출 | p50 | p99 | DB 호출/회 | 3초 초과']
+    counters, _, histograms = metrics.snapshot()
+    db_calls = Counter()
+    for (name, labels), value in counters:
+        if name == 'db_calls_total':
+            db_calls[dict(labels)['command']] += value
+    for (name, labels), histogram in sorted(histograms, key=lambda pair: pair[0]):
+        if name != 'command_seconds':
+            continue
+        command_name = dict(labels)['command']
+        lines.append(f"/{command_name} | {histogram.count} | {histogram.quantile(0.5) * 1000:g}ms | {histogram.quantile(0.99) * 1000:g}ms"
+                     f" | {db_calls[command_name] / histogram.count:.1f} | {metrics.counter('deadline_misses_total', command=command_name)}")
+    if len(lines) == 1:
+        lines.append('아직 처리된 커맨드가 없습니다.')
+    errors = sum(value for (name, _), value in counters if name.endswith('errors_total'))
+    errors += sum(value for (name, labels), value in counters if name == 'commands_total' and ('status', 'error') in labels)
+    lag = metrics.histogram('event_loop_lag_seconds')
+    if lag is not None:
+        lines.append(f'이벤트 루프 지연 p99: {lag.quantile(0.99) * 1000:g}ms')
+    lines.append(f'오류: {errors}회, 캐시된 서버: {len(guild_states)}개')
+    return '\n'.join(lines)
+
+# 슬래시 커맨드: 봇 성능 지표 확인 (어드민 전용)
+@bot.tree.command(name='stats', description='Show command latency and storage call statistics.')
+async def show_stats(interaction: discord.Interaction):
+    if interaction.user.guild_permissions.administrator:
+        await safe_send(interaction, f"```\n{format_stats()}\n```", ephemeral=True)
     else:
         await safe_send(interaction, "이 명령어를 사용할 권한이 없습니다.", ephemeral=True)
 
 # 슬래시 명령어를 추가하기 위해 bot에 명령어를 등록
+# (GUILD_ID가 있으면 해당 서버에만 바로 반영, 없으면 모든 서버에 전역으로 등록)
+# (명령어 정의의 해시가 지난번 동기화 때와 같으면 동기화를 건너뜀)
 async def setup_slash_commands():
-    guild = discord.Object(id=os.getenv('GUILD_ID'))
-    bot.tree.copy_global_to(guild=guild)
-    await bot.tree.sync(guild=guild)
-    print(f'Slash commands synced for guild ID: {guild.id}')
+    signature = command_signature()
+    if read_text(COMMANDS_HASH_PATH) == signature:
+        print('Slash commands unchanged, skipping sync')
+        return
+    try:
+        if not os.getenv('GUILD_ID'):
+            await bot.tree.sync()
+            print('Slash commands synced globally')
+        else:
+            guild = discord.Object(id=os.getenv('GUILD_ID'))
+            bot.tree.copy_global_to(guild=guild)
+            await bot.tree.sync(guild=guild)
+            print(f'Slash commands synced for guild ID: {guild.id}')
+    except discord.HTTPException as e:
+        print(f'Error syncing slash commands: {e}')
+        return
+    write_text(COMMANDS_HASH_PATH, signature)
+
+def command_signature():
+    payload = []
+    for command in sorted(bot.tree.get_commands(), key=lambda command: command.name):
+        try:
+            payload.append(command.to_dict(bot.tree))
+        except TypeError:  # discord.py 2.0~2.3은 인자가 없음
+            payload.append(command.to_dict())
+    data = json.dumps([bot.application_id, os.getenv('GUILD_ID'), payload], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+# catalog 컬렉션을 읽어 새 스냅샷으로 교체 (비어 있으면 기본 목록으로 채움)
+async def load_catalog():
+    global catalog
+    try:
+        docs = await catalog_collection.find_list({}, {'_id': 0})
+        if not docs:
+            docs = default_catalog_docs()
+            await catalog_collection.insert_many([dict(doc) for doc in docs])
+        snapshot = await asyncio.get_running_loop().run_in_executor(None, _build_catalog, docs, catalog.version)
+    except Exception as e:
+        print(f'Error loading catalog: {e}')
+        return
+    if snapshot is not None:
+        catalog = snapshot
+        on_catalog_changed()
+
+# 항목 목록만으로 버전을 먼저 비교해, 바뀌었을 때만 인덱스까지 포함한 스냅샷을 만듦 (스레드에서 실행)
+def _build_catalog(docs, current_version):
+    entries = [catalog_entry_from_doc(doc) for doc in docs]
+    if catalog_version(entries) == current_version:
+        return None
+    return CatalogSnapshot(entries)
+
+# 새로 추가된 아이템은 메모리에 올라와 있는 모든 서버에서 재고/시세를 "N/A"로 채워 둠
+def on_catalog_changed():
+    for state in guild_states:
+        state.on_catalog_changed()
+    print(f'Catalog loaded: {len(catalog.creatures)} creatures, {len(catalog.items)} items')
+
+# 변경 스트림을 쓸 수 없는 환경(단일 mongod 등)에서 카탈로그를 다시 읽는 주기(초)
+CATALOG_POLL_SECONDS = float(os.getenv('CATALOG_POLL_SECONDS', '30'))
+catalog_watcher = None
+
+# 변경 스트림은 블로킹 반복이므로 별도 스레드에서 기다렸다가 이벤트 루프에 재로드를 요청
+def _watch_catalog_changes(loop):
+    try:
+        with catalog_collection.collection.watch() as stream:
+            for _ in stream:
+                asyncio.run_coroutine_threadsafe(load_catalog(), loop)
+    except Exception as e:
+        print(f'Catalog change stream unavailable, polling every {CATALOG_POLL_SECONDS}s: {e}')
+        asyncio.run_coroutine_threadsafe(poll_catalog(), loop)
+
+async def poll_catalog():
+    while True:
+        await asyncio.sleep(CATALOG_POLL_SECONDS)
+        await load_catalog()
+
+def start_catalog_watcher():
+    global catalog_watcher
+    if catalog_watcher is None:
+        catalog_watcher = threading.Thread(target=_watch_catalog_changes, args=(asyncio.get_running_loop(),), daemon=True)
+        catalog_watcher.start()
 
 # 데이터 로드 함수
-def load_inventory():
+async def fetch_inventory(guild_id):
+    inventory_data = await inventory_collection.find_list({'guild_id': guild_id})
+    inventory = {item['item']: item['quantity'] for item in inventory_data}
+    for item in catalog.names:
+        if item not in inventory:
+            inventory[item] = "N/A"
+    return inventory
+
+async def load_inventory(guild_id):
     try:
-        inventory_data = inventory_collection.find({})
-        inventory = {item['item']: item['quantity'] for item in inventory_data}
-        for item in creatures + items:
-            if item not in inventory:
-                inventory[item] = "N/A"
-        return inventory
+        return await fetch_inventory(guild_id)
     except Exception as e:
         print(f'Error loading inventory: {e}')
-        return {item: "N/A" for item in creatures + items}
+        return {item: "N/A" for item in catalog.names}
 
-def save_inventory(inventory):
+async def fetch_prices(guild_id):
+    prices_data = await prices_collection.find_list({'guild_id': guild_id})
+    prices = {item['item']: {'슘 시세': item['shoom_price'], '현금 시세': item['cash_price']} for item in prices_data}
+    for item in catalog.names:
+        if item not in prices:
+            prices[item] = {'슘 시세': "N/A", '현금 시세': "N/A"}
+    return prices
+
+async def load_prices(guild_id):
     try:
-        for item, quantity in inventory.items():
-            inventory_collection.update_one({'item': item}, {'$set': {'quantity': quantity}}, upsert=True)
-        print("Inventory saved successfully")
+        return await fetch_prices(guild_id)
     except Exception as e:
-        print(f'Error saving inventory: {e}')
+        print(f'Error loading prices: {e}')
+        return {item: {'슘 시세': "N/A", '현금 시세': "N/A"} for item in catalog.names}
 
-def load_prices():
+# 서버별 할인 프로필과 적용 중인 프로필 (guild_settings에 저장, 프로필 이름은 필드 이름으로 쓸 수 없는 문자가 있을 수 있어 목록으로 저장)
+async def fetch_discount_profiles(guild_id):
+    settings = await settings_collection.find_one({'_id': guild_id}, {'discount_profiles': 1, 'active_discount': 1}) or {}
+    profiles = {profile['name']: profile['percentage'] for profile in settings.get('discount_profiles', [])}
+    return profiles, settings.get('active_discount')
+
+async def load_discount_profiles(guild_id):
     try:
-        prices_data = prices_collection.find({})
-        prices = {item['item']: {'슘 시세': item['shoom_price'], '현금 시세': item['cash_price']} for item in prices_data}
-        for item in creatures + items:
-            if item not in prices:
-                prices[item] = {'슘 시세': "N/A", '현금 시세': "N/A"}
-        return prices
+        return await fetch_discount_profiles(guild_id)
     except Exception as e:
-        print(f'Error loading prices: {e}')
-        return {item: {'슘 시세': "N/A", '현금 시세': "N/A"} for item in creatures + items}
+        print(f'Error loading discount profiles: {e}')
+        return {}, None
+
+async def save_discount_profiles(guild_id, pricing):
+    profiles = [{'name': name, 'percentage': percentage} for name, percentage in pricing.profiles.items()]
+    await settings_collection.update_one({'_id': guild_id}, {'$set': {'discount_profiles': profiles, 'active_discount': pricing.active}}, upsert=True)
+
+# 변경된 키만 모아 두었다가 짧은 지연 후 한 번의 bulk_write로 저장하는 버퍼
+FLUSH_DELAY = float(os.getenv('FLUSH_DELAY', '0.5'))
+
+class WriteBehindBuffer:
+    def __init__(self, name, collection, build_op, delay=FLUSH_DELAY, after_save=None):
+        self.name = name
+        self.collection = collection
+        self.build_op = build_op
+        self.after_save = after_save  # 저장에 성공한 키로 호출되는 코루틴 함수
+        self.delay = delay
+        self.dirty = set()
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+
+    def mark(self, *keys):
+        self.dirty.update(keys)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        # 지연 시간 동안 들어온 변경을 묶어서 저장하고, 저장 중 새로 들어온 변경도 이어서 처리
+        while self.dirty:
+            await asyncio.sleep(self.delay)
+            if not await self.flush():
+                return
+
+    async def flush(self):
+        async with self.lock:
+            if not self.dirty:
+                return True
+            keys, self.dirty = self.dirty, set()
+            try:
+                await self.collection.bulk_write([self.build_op(key) for key in keys], ordered=False)
+                print(f"{self.name} saved successfully ({len(keys)} items)")
+            except Exception as e:
+                # 실패한 키는 다음 저장 때 다시 시도
+                self.dirty |= keys
+                metrics.inc('flush_errors_total', buffer=self.name)
+                print(f'Error saving {self.name}: {e}')
+                return False
+            if self.after_save:
+                await self.after_save(keys)
+            return True
 
-def save_prices(prices):
+# 서버별 재고/시세와 그 서버의 가격 계산, 렌더링 캐시, 저장 버퍼
+class GuildState:
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.inventory = {}
+        self.prices = {}
+        self.pricing = PricingEngine(self.prices)
+        self.render_cache = RenderCache()
+        self.prices_writer = WriteBehindBuffer('Prices', prices_collection, self.build_prices_op, after_save=self.record_price_history)
+        self.loaded = False
+        self.load_lock = asyncio.Lock()
+        self.warm = False  # 로컬 스냅샷에서 불러와 DB와 아직 대조하지 않은 상태
+        self.touched = set()  # 대조 중에 바뀐 아이템 (DB에서 읽은 이전 값으로 덮어쓰지 않음)
+
+    def build_prices_op(self, item):
+        price = self.prices[item]
+        return UpdateOne({'guild_id': self.guild_id, 'item': item},
+                         {'$set': {'shoom_price': price['슘 시세'], 'cash_price': price['현금 시세']}}, upsert=True)
+
+    async def record_price_history(self, items):
+        await record_price_changes(self.guild_id, {item: self.prices[item]['슘 시세'] for item in items if item in self.prices})
+
+    async def ensure_loaded(self):
+        if self.loaded or self.warm:
+            return
+        async with self.load_lock:
+            if not self.loaded:
+                if migration_done is not None:
+                    await migration_done.wait()
+                self.inventory.update(await load_inventory(self.guild_id))
+                self.prices.update(await load_prices(self.guild_id))
+                self.pricing.load_profiles(*await load_discount_profiles(self.guild_id))
+                await ensure_rollups(self.guild_id)
+                self.loaded = True
+                self.pricing.invalidate()
+                self.render_cache.invalidate_all()
+
+    def invalidate_prices(self, *items):
+        self.touched.update(items)
+        self.pricing.invalidate()
+        self.render_cache.invalidate(*items)
+
+    def inventory_changed(self, *items):
+        self.touched.update(items)
+        self.render_cache.invalidate(*items)
+
+    # 스냅샷 값으로 응답하는 동안 DB 값을 읽어 와서 교체
+    async def reconcile(self):
+        async with self.load_lock:
+            self.touched.clear()
+            try:
+                inventory = await fetch_inventory(self.guild_id)
+                prices = await fetch_prices(self.guild_id)
+                profiles, active = await fetch_discount_profiles(self.guild_id)
+                await ensure_rollups(self.guild_id)
+            except Exception as e:
+                print(f'Error reconciling guild {self.guild_id}, keeping snapshot: {e}')
+                return
+            self.pricing.load_profiles(profiles, active)
+            self.inventory.update((item, quantity) for item, quantity in inventory.items() if item not in self.touched)
+            self.prices.update((item, price) for item, price in prices.items() if item not in self.touched)
+            self.loaded = True
+            self.warm = False
+            self.pricing.invalidate()
+            self.render_cache.invalidate_all()
+
+    # DB에서 직접 바뀐 데이터(가져오기 등)를 다시 읽음
+    async def reload(self):
+        await self.prices_writer.flush()
+        self.loaded = False
+        self.warm = False
+        await self.ensure_loaded()
+
+    def on_catalog_changed(self):
+        for item in catalog.names:
+            self.inventory.setdefault(item, "N/A")
+            self.prices.setdefault(item, {'슘 시세': "N/A", '현금 시세': "N/A"})
+        self.pricing.invalidate()
+        self.render_cache.invalidate_all()
+
+# 메모리에 올려 둘 최대 서버 수 (오래 쓰지 않은 서버부터 내보냄)
+MAX_CACHED_GUILDS = int(os.getenv('MAX_CACHED_GUILDS', '100'))
+
+class GuildStateCache:
+    def __init__(self, max_guilds=MAX_CACHED_GUILDS):
+        self.max_guilds = max_guilds
+        self.states = OrderedDict()
+        self.flushing = {}  # 내보낸 서버 id -> 아직 저장되지 않은 시세를 기록하는 작업
+
+    async def get(self, guild_id):
+        state = self.states.get(guild_id)
+        if state is None:
+            state = self.states[guild_id] = GuildState(guild_id)
+            self.evict()
+        else:
+            self.states.move_to_end(guild_id)
+        # 방금 내보낸 서버를 다시 불러오면 남은 시세가 저장된 뒤에 읽어야 이전 값을 읽지 않음
+        pending = self.flushing.get(guild_id)
+        if pending is not None:
+            await asyncio.shield(pending)
+        await state.ensure_loaded()
+        return state
+
+    def evict(self):
+        while len(self.states) > self.max_guilds:
+            guild_id, state = self.states.popitem(last=False)
+            # 내보낸 서버에 아직 저장되지 않았거나 저장 중인 시세가 있으면 백그라운드에서 마저 기록
+            writer = state.prices_writer
+            if writer.dirty or (writer.flush_task is not None and not writer.flush_task.done()):
+                task = self.flushing[guild_id] = run_in_background(writer.flush())
+                task.add_done_callback(functools.partial(self.flushed, guild_id))
+
+    def flushed(self, guild_id, task):
+        if self.flushing.get(guild_id) is task:
+            del self.flushing[guild_id]
+
+    async def wait_for_evicted(self):
+        if self.flushing:
+            await asyncio.gather(*self.flushing.values(), return_exceptions=True)
+
+    # 로컬 스냅샷의 값으로 서버 상태를 만들어 DB를 읽지 않고 바로 응답
+    def restore(self, guild_id, inventory, prices, discounts=None):
+        state = self.states[guild_id] = GuildState(guild_id)
+        state.inventory.update(inventory)
+        state.prices.update(prices)
+        if discounts:
+            state.pricing.load_profiles(discounts['profiles'], discounts['active'])
+        state.on_catalog_changed()
+        state.warm = True
+        self.evict()
+
+    def __iter__(self):
+        return iter(list(self.states.values()))
+
+    def __len__(self):
+        return len(self.states)
+
+guild_states = GuildStateCache()
+
+async def flush_all_writers():
+    for state in guild_states:
+        await state.prices_writer.flush()
+    await guild_states.wait_for_evicted()
+
+# 로컬 스냅샷: 카탈로그와 메모리에 올라온 서버들의 재고/시세를 BASE_DIR에 저장해 두고
+# 다음 시작 때 DB 연결을 기다리지 않고 먼저 불러옴 (docker-compose에서는 /data 볼륨)
+BASE_DIR = os.getenv('BASE_DIR', os.path.dirname(os.path.abspath(__file__)))
+SNAPSHOT_PATH = os.path.join(BASE_DIR, 'snapshot.json')
+COMMANDS_HASH_PATH = os.path.join(BASE_DIR, 'commands.sha256')
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv('SNAPSHOT_INTERVAL_SECONDS', '300'))
+
+def read_text(path):
     try:
-        for item, price in prices.items():
-            prices_collection.update_one({'item': item}, {'$set': {'shoom_price': price['슘 시세'], 'cash_price': price['현금 시세']}}, upsert=True)
-        print("Prices saved successfully")
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
+
+# 임시 파일에 쓴 뒤 바꿔 끼워서 중간에 종료돼도 파일이 깨지지 않게 함
+def write_text(path, text):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f'Error writing {path}: {e}')
+
+def _read_snapshot():
+    text = read_text(SNAPSHOT_PATH)
+    if text is None:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        print(f'Ignoring corrupt snapshot: {e}')
+        return None
+
+def restore_snapshot(snapshot):
+    global catalog
+    if snapshot.get('catalog'):
+        catalog = CatalogSnapshot([catalog_entry_from_doc(doc) for doc in snapshot['catalog']])
+    for guild_id, saved in snapshot.get('guilds', {}).items():
+        guild_states.restore(int(guild_id), saved['inventory'], saved['prices'], saved.get('discounts'))
+    print(f"Restored snapshot from {datetime.fromtimestamp(snapshot['saved_at'])}: {len(snapshot.get('guilds', {}))} guilds")
+
+def _write_snapshot(snapshot):
+    write_text(SNAPSHOT_PATH, json.dumps(snapshot, ensure_ascii=False))
+
+async def save_snapshot():
+    # 이벤트 루프에서 복사본을 만든 뒤 직렬화와 파일 쓰기는 스레드에서 실행
+    snapshot = {
+        'saved_at': time.time(),
+        'catalog': [entry._asdict() for entry in catalog.entries.values()],
+        'guilds': {str(state.guild_id): {'inventory': dict(state.inventory), 'prices': {item: dict(price) for item, price in state.prices.items()},
+                                         'discounts': {'profiles': dict(state.pricing.profiles), 'active': state.pricing.active}}
+                   for state in guild_states if state.loaded or state.warm},
+    }
+    await asyncio.get_running_loop().run_in_executor(None, _write_snapshot, snapshot)
+
+@tasks.loop(seconds=SNAPSHOT_INTERVAL_SECONDS)
+async def save_snapshot_periodically():
+    await save_snapshot()
+
+# 판매 내역 한 페이지에 보여줄 기록 수
+SALES_PAGE_SIZE = int(os.getenv('SALES_PAGE_SIZE', '10'))
+
+# 날짜 범위(YYYY-MM-DD, 종료일 포함)를 timestamp 조건으로 변환
+def sales_date_filter(start_date=None, end_date=None):
+    timestamp = {}
+    if start_date:
+        timestamp['$gte'] = datetime.strptime(start_date, '%Y-%m-%d').timestamp()
+    if end_date:
+        timestamp['$lt'] = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).timestamp()
+    return {'timestamp': timestamp} if timestamp else {}
+
+# 유저별 판매 합계와 건수를 원장에서 집계 (날짜 범위 조회용, 취소 이벤트는 음수로 반영)
+async def sales_summary(match):
+    sign = {'$cond': [{'$eq': ['$type', REVERSAL]}, -1, 1]}
+    pipeline = [
+        {'$match': match},
+        {'$sort': {'timestamp': 1}},
+        {'$group': {
+            '_id': '$user_id',
+            'name': {'$last': '$user_display_name'},
+            'total': {'$sum': {'$multiply': ['$amount', sign]}},
+            'count': {'$sum': sign},
+        }},
+        {'$match': {'count': {'$ne': 0}}},
+        {'$sort': {'total': -1}},
+    ]
+    return await sales_collection.aggregate_list(pipeline)
+
+# 정산 기간의 유저별 합계를 롤업 문서에서 바로 읽음
+async def period_user_summary(guild_id, period):
+    rows = await rollups_collection.find_list({'guild_id': guild_id, 'kind': 'user', 'period': period, 'count': {'$ne': 0}},
+                                              sort=[('total', -1)])
+    return [{'_id': row['user_id'], 'name': row['name'], 'total': row['total'], 'count': row['count']} for row in rows]
+
+async def period_totals(guild_id, period):
+    return await rollups_collection.find_one({'_id': rollup_id(guild_id, 'period', period)}) or {'total': 0, 'count': 0}
+
+# 최근 days일 동안의 아이템별 하루 평균 판매 수량 (일별 롤업 문서 days개씩만 읽음)
+SALES_VELOCITY_DAYS = 7
+
+async def item_velocity(guild_id, days=SALES_VELOCITY_DAYS):
+    today = datetime.now()
+    day_keys = [(today - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days)]
+    rows = await rollups_collection.find_list({'guild_id': guild_id, 'kind': 'item_day', 'day': {'$in': day_keys}})
+    totals = Counter()
+    for row in rows:
+        totals[row['item']] += row['quantity']
+    return {item: quantity / days for item, quantity in totals.items() if quantity > 0}
+
+# (timestamp, _id) 커서 이후의 판매 기록 한 페이지와 다음 페이지 존재 여부를 반환
+async def fetch_sales_page(match, after=None, limit=SALES_PAGE_SIZE):
+    query = dict(match)
+    if after is not None:
+        timestamp, sale_id = after
+        query = {'$and': [match, {'$or': [
+            {'timestamp': {'$gt': timestamp}},
+            {'timestamp': timestamp, '_id': {'$gt': sale_id}},
+        ]}]}
+    records = await sales_collection.find_list(query, sort=[('timestamp', 1), ('_id', 1)], limit=limit + 1)
+    return records[:limit], len(records) > limit
+
+# 자주 쓰는 조회 조건에 대한 인덱스 생성 (이미 있으면 무시됨, 모두 guild_id로 시작)
+# (인덱스마다 따로 만들어서 하나가 실패해도 나머지는 만들어짐)
+async def ensure_indexes():
+    indexes = [
+        (inventory_collection, [('guild_id', 1), ('item', 1)], {'unique': True}),
+        (prices_collection, [('guild_id', 1), ('item', 1)], {'unique': True}),
+        (sales_collection, [('guild_id', 1), ('user_id', 1), ('timestamp', 1)], {}),
+        (sales_collection, [('guild_id', 1), ('timestamp', 1), ('_id', 1)], {}),
+        (sales_collection, [('guild_id', 1), ('period', 1), ('timestamp', 1), ('_id', 1)], {}),
+        # 한 판매는 한 번만 취소할 수 있음
+        (sales_collection, [('sale_id', 1)], {'unique': True, 'partialFilterExpression': {'type': REVERSAL}}),
+        (rollups_collection, [('guild_id', 1), ('kind', 1), ('period', 1)], {}),
+        (rollups_collection, [('guild_id', 1), ('kind', 1), ('day', 1)], {}),
+        (jobs_collection, [('status', 1), ('created_at', 1)], {}),
+        (jobs_collection, [('active_key', 1)], {'unique': True, 'partialFilterExpression': {'active_key': {'$exists': True}}}),
+        (price_history_collection, [('kind', 1), ('scope', 1), ('item', 1), ('day', 1)], {}),
+        (jobs_collection, [('finished_at', 1)], {'expireAfterSeconds': JOB_RETENTION_SECONDS}),
+    ]
+    for collection, keys, options in indexes:
+        try:
+            await collection.create_index(keys, **options)
+        except Exception as e:
+            print(f'Error creating index {keys} on {collection.collection.name}: {e}')
+
+# guild_id 없이 저장된 기존 단일 서버 데이터를 GUILD_ID 서버의 데이터로 옮김
+# (원장 이전의 판매 기록은 첫 정산 기간의 판매 이벤트로 표시)
+async def migrate_legacy_documents():
+    result = await sales_collection.update_many({'type': {'$exists': False}}, {'$set': {'type': SALE, 'period': 0}})
+    if result.modified_count:
+        print(f'Marked {result.modified_count} legacy sales as ledger events')
+    if not os.getenv('GUILD_ID'):
+        return
+    guild_id = int(os.getenv('GUILD_ID'))
+    for collection in (inventory_collection, prices_collection, sales_collection):
+        result = await collection.update_many({'guild_id': {'$exists': False}}, {'$set': {'guild_id': guild_id}})
+        if result.modified_count:
+            print(f'Assigned {result.modified_count} legacy {collection.collection.name} documents to guild {guild_id}')
+
+# 판매 원장: sales 컬렉션에는 판매/취소/정산 이벤트를 추가만 하고,
+# 유저/아이템/일/정산 기간별 합계는 sales_rollups 문서에 이벤트와 같은 쓰기에서 $inc로 반영
+SALE, REVERSAL, SETTLEMENT = 'sale', 'reversal', 'settlement'
+
+def rollup_id(guild_id, kind, *key):
+    return ':'.join(str(part) for part in (guild_id, kind) + key)
+
+def rollup_update(guild_id, kind, key_fields, inc, fields=None):
+    update = {'$inc': inc, '$setOnInsert': {'guild_id': guild_id, 'kind': kind, **key_fields}}
+    if fields:
+        update['$set'] = fields
+    return UpdateOne({'_id': rollup_id(guild_id, kind, *key_fields.values())}, update, upsert=True)
+
+# 판매(+)나 취소(-) 이벤트 하나가 바꾸는 롤업 목록: (종류, 키 필드, 더할 값, 덮어쓸 값)
+def rollup_changes(event):
+    sign = -1 if event['type'] == REVERSAL else 1
+    period = event['period']
+    day = datetime.fromtimestamp(event['timestamp']).strftime('%Y-%m-%d')
+    totals = {'total': event['amount'] * sign, 'count': sign}
+    changes = [
+        ('period', {'period': period}, totals, None),
+        ('user', {'period': period, 'user_id': event.get('user_id')}, totals, {'name': event.get('user_display_name', '알 수 없음')}),
+        ('day', {'day': day}, totals, None),
+    ]
+    for item, quantity in event.get('items_sold', []):
+        changes.append(('item', {'period': period, 'item': item}, {'quantity': quantity * sign}, None))
+        changes.append(('item_day', {'day': day, 'item': item}, {'quantity': quantity * sign}, None))
+    return changes
+
+def rollup_ops(event):
+    return [rollup_update(event['guild_id'], *change) for change in rollup_changes(event)]
+
+# 정산: 현재 기간을 닫고 다음 기간 번호로 넘어감
+def settlement_ops(guild_id, period, timestamp):
+    return [
+        UpdateOne({'_id': rollup_id(guild_id, 'period', period)},
+                  {'$set': {'settled_at': timestamp}, '$setOnInsert': {'guild_id': guild_id, 'kind': 'period', 'period': period, 'total': 0, 'count': 0}},
+                  upsert=True),
+        UpdateOne({'_id': rollup_id(guild_id, 'guild')},
+                  {'$inc': {'period': 1}, '$setOnInsert': {'guild_id': guild_id, 'kind': 'guild'}}, upsert=True),
+    ]
+
+# 같은 롤업 문서를 동시에 처음 upsert하면 한쪽이 중복 키 오류를 받으므로, 그 업데이트만 다시 실행
+# (트랜잭션 안에서는 트랜잭션 재시도에 맡김)
+def _apply_rollups(ops, session=None):
+    try:
+        rollups_collection.collection.bulk_write(ops, ordered=False, session=session)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if session is not None or any(error['code'] != 11000 for error in errors):
+            raise
+        rollups_collection.collection.bulk_write([ops[error['index']] for error in errors], ordered=False)
+
+def _current_period(guild_id, session=None):
+    doc = rollups_collection.collection.find_one({'_id': rollup_id(guild_id, 'guild')}, session=session)
+    return doc['period'] if doc else 0
+
+def _settle_sales(guild_id, user_id):
+    def apply(session):
+        period = _current_period(guild_id, session)
+        totals = rollups_collection.collection.find_one({'_id': rollup_id(guild_id, 'period', period)}, session=session) or {}
+        event = {
+            'guild_id': guild_id,
+            'type': SETTLEMENT,
+            'period': period,
+            'timestamp': time.time(),
+            'user_id': user_id,
+            'total': totals.get('total', 0),
+            'count': totals.get('count', 0),
+        }
+        sales_collection.collection.insert_one(event, session=session)
+        _apply_rollups(settlement_ops(guild_id, period, event['timestamp']), session)
+        return event
+    return _run_transaction(apply)
+
+# 원장 전체를 읽어 메모리에서 롤업 문서를 계산 (롤업 id -> 문서)
+def compute_rollups(guild_id, events):
+    docs = {}
+    period = 0
+    for event in events:
+        event.setdefault('type', SALE)
+        event.setdefault('period', period)
+        if event['type'] == SETTLEMENT:
+            doc = docs.setdefault(rollup_id(guild_id, 'period', event['period']),
+                                  {'guild_id': guild_id, 'kind': 'period', 'period': event['period'], 'total': 0, 'count': 0})
+            doc['settled_at'] = event['timestamp']
+            period = event['period'] + 1
+            continue
+        for kind, key_fields, inc, fields in rollup_changes(event):
+            doc = docs.setdefault(rollup_id(guild_id, kind, *key_fields.values()), {'guild_id': guild_id, 'kind': kind, **key_fields})
+            for field, value in inc.items():
+                doc[field] = doc.get(field, 0) + value
+            if fields:
+                doc.update(fields)
+    # 판매가 없는 서버도 롤업이 준비되었다는 표시로 guild 문서를 만듦
+    docs[rollup_id(guild_id, 'guild')] = {'guild_id': guild_id, 'kind': 'guild', 'period': period}
+    return docs
+
+# 여러 프로세스가 같은 서버의 롤업을 동시에 다시 만들지 않도록 롤업 컬렉션에 임대 문서를 둠
+# (만료 전이면 upsert가 같은 _id로 삽입을 시도하다 중복 키 오류가 나므로 다른 쪽이 가진 것)
+REBUILD_LEASE_SECONDS = 120
+
+def _acquire_rebuild_lease(guild_id, wait):
+    deadline = time.monotonic() + REBUILD_LEASE_SECONDS
+    while True:
+        now = time.time()
+        try:
+            rollups_collection.collection.find_one_and_update(
+                {'_id': rollup_id(guild_id, 'rebuild'), 'expires_at': {'$lt': now}},
+                {'$set': {'expires_at': now + REBUILD_LEASE_SECONDS}, '$setOnInsert': {'guild_id': guild_id, 'kind': 'rebuild'}},
+                upsert=True)
+            return True
+        except DuplicateKeyError:
+            if not wait or time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+
+# 원장으로 롤업을 다시 계산해 값을 덮어씀 (롤업이 없는 서버를 처음 불러올 때와 판매 기록을 가져온 뒤 사용)
+# 문서를 지우지 않고 덮어쓰므로 도중에도 guild 문서(현재 기간)가 사라지지 않고, 트랜잭션을 쓰면
+# 동시에 들어온 판매와 쓰기 충돌이 나 한쪽이 다시 실행되므로 두 번 더해지지 않음
+# (wait이 False면 다른 프로세스가 이미 다시 만드는 중일 때 건너뛰고 None을 반환)
+def _rebuild_rollups(guild_id, wait=True):
+    if not _acquire_rebuild_lease(guild_id, wait):
+        return None
+    try:
+        def apply(session):
+            events = sales_collection.collection.find({'guild_id': guild_id}, session=session).sort([('timestamp', 1), ('_id', 1)])
+            docs = compute_rollups(guild_id, events)
+            rollups_collection.collection.bulk_write([ReplaceOne({'_id': doc_id}, doc, upsert=True) for doc_id, doc in docs.items()],
+                                                     ordered=False, session=session)
+            if session is not None:
+                # 원장에 없는 이벤트로 남은 롤업은 트랜잭션 안에서만 지움 (밖에서는 방금 생긴 판매 롤업을 지울 수 있음)
+                rollups_collection.collection.delete_many({'guild_id': guild_id, 'kind': {'$ne': 'rebuild'}, '_id': {'$nin': list(docs)}},
+                                                          session=session)
+            return len(docs) - 1
+        return _run_transaction(apply)
+    finally:
+        rollups_collection.collection.delete_one({'_id': rollup_id(guild_id, 'rebuild')})
+
+# 재고 변경은 서버에서 원자적으로 처리하고 결과로 메모리 캐시를 갱신
+# (여러 봇 프로세스가 같은 DB를 써도 재고가 초과 판매되지 않도록 함)
+# (mongomock은 트랜잭션을 지원하지 않으므로 기본으로 끔)
+USE_TRANSACTIONS = os.getenv('MONGODB_TRANSACTIONS', '0' if IN_MEMORY_DB else '1') == '1'
+
+class InsufficientStock(Exception):
+    def __init__(self, item, quantity):
+        super().__init__(f'Not enough "{item}" in inventory: {quantity} requested')
+        self.item = item
+        self.quantity = quantity
+
+# 기존 재고가 "N/A" 등 숫자가 아니면 0으로 보고 더하는 업데이트 파이프라인
+def stock_increment_update(quantity):
+    current = {'$cond': [{'$isNumber': '$quantity'}, '$quantity', 0]}
+    return [{'$set': {'quantity': {'$add': [current, quantity]}}}]
+
+def _increment_stock(guild_id, item, quantity, session=None):
+    doc = inventory_collection.collection.find_one_and_update(
+        {'guild_id': guild_id, 'item': item}, stock_increment_update(quantity),
+        upsert=True, return_document=ReturnDocument.AFTER, session=session)
+    return doc['quantity']
+
+def _decrement_stock(guild_id, item, quantity, session=None):
+    doc = inventory_collection.collection.find_one_and_update(
+        {'guild_id': guild_id, 'item': item, 'quantity': {'$gte': quantity}}, {'$inc': {'quantity': -quantity}},
+        return_document=ReturnDocument.AFTER, session=session)
+    if doc is None:
+        raise InsufficientStock(item, quantity)
+    return doc['quantity']
+
+# 트랜잭션 안에서 실행하거나, 트랜잭션을 쓰지 않으면 그대로 실행
+def _run_transaction(callback):
+    if not USE_TRANSACTIONS:
+        return callback(None)
+    with get_client().start_session() as session:
+        return session.with_transaction(callback)
+
+def _record_sale(guild_id, items_sold, sale_record):
+    # 같은 아이템이 여러 칸에 입력된 경우 수량을 합쳐서 한 번에 검사
+    totals = {}
+    for item, quantity in items_sold:
+        totals[item] = totals.get(item, 0) + quantity
+
+    def apply(session):
+        remaining = {}
+        inserted = False
+        try:
+            for item, quantity in totals.items():
+                remaining[item] = _decrement_stock(guild_id, item, quantity, session)
+            sale_record['type'] = SALE
+            sale_record['period'] = _current_period(guild_id, session)
+            sales_collection.collection.insert_one(sale_record, session=session)
+            inserted = True
+            _apply_rollups(rollup_ops(sale_record), session)
+        except Exception:
+            # 트랜잭션이 없으면 이미 차감한 재고와 기록한 판매를 되돌림
+            if session is None:
+                for item in remaining:
+                    _increment_stock(guild_id, item, totals[item])
+                if inserted:
+                    sales_collection.collection.delete_one({'_id': sale_record['_id']})
+            raise
+        return remaining
+    return _run_transaction(apply)
+
+# 판매 취소: 원래 기록은 남기고 취소 이벤트를 추가한 뒤 재고를 복구
+def _cancel_sale(guild_id, sale_id):
+    def apply(session):
+        sale_record = sales_collection.collection.find_one({'_id': ObjectId(sale_id), 'guild_id': guild_id, 'type': SALE}, session=session)
+        if sale_record is None:
+            return None, {}
+        if sales_collection.collection.find_one({'sale_id': sale_record['_id'], 'type': REVERSAL}, session=session):
+            return None, {}
+        reversal = {
+            'guild_id': guild_id,
+            'type': REVERSAL,
+            'sale_id': sale_record['_id'],
+            'period': _current_period(guild_id, session),
+            'amount': sale_record.get('amount', 0),
+            'buyer_name': sale_record.get('buyer_name'),
+            'items_sold': sale_record.get('items_sold', []),
+            'timestamp': time.time(),
+            'user_id': sale_record.get('user_id'),
+            'user_display_name': sale_record.get('user_display_name', '알 수 없음'),
+        }
+        try:
+            sales_collection.collection.insert_one(reversal, session=session)
+        except DuplicateKeyError:
+            # 동시에 들어온 다른 취소 요청이 먼저 처리됨
+            return None, {}
+        restored = {}
+        for item, quantity in reversal['items_sold']:
+            restored[item] = _increment_stock(guild_id, item, quantity, session)
+        _apply_rollups(rollup_ops(reversal), session)
+        return sale_record, restored
+    return _run_transaction(apply)
+
+async def increment_stock(state, item, quantity):
+    state.inventory[item] = await inventory_collection.run(_increment_stock, state.guild_id, item, quantity)
+    state.inventory_changed(item)
+    return state.inventory[item]
+
+async def decrement_stock(state, item, quantity):
+    state.inventory[item] = await inventory_collection.run(_decrement_stock, state.guild_id, item, quantity)
+    state.inventory_changed(item)
+    return state.inventory[item]
+
+async def record_sale(state, items_sold, sale_record):
+    remaining = await inventory_collection.run(_record_sale, state.guild_id, items_sold, sale_record)
+    state.inventory.update(remaining)
+    state.inventory_changed(*remaining)
+    for item, quantity in items_sold:
+        item_popularity[item] += quantity
+
+async def cancel_sale(state, sale_id):
+    sale_record, restored = await inventory_collection.run(_cancel_sale, state.guild_id, sale_id)
+    state.inventory.update(restored)
+    state.inventory_changed(*restored)
+    return sale_record
+
+async def settle_sales(guild_id, user_id):
+    return await sales_collection.run(_settle_sales, guild_id, user_id)
+
+async def current_period(guild_id):
+    return await rollups_collection.run(_current_period, guild_id)
+
+async def ensure_rollups(guild_id):
+    if await rollups_collection.find_one({'_id': rollup_id(guild_id, 'guild')}) is None:
+        count = await rollups_collection.run(_rebuild_rollups, guild_id, False)
+        if count is not None:
+            print(f'Rebuilt sales rollups for guild {guild_id} ({count} updates)')
+
+# 내보내기/가져오기: 커서를 배치 단위로 읽어 gzip 파일에 바로 쓰고, 가져올 때는 파일을 두 번 읽음
+# (먼저 모든 행을 카탈로그로 검사한 뒤, 통과하면 청크 단위 bulk_write를 한 트랜잭션으로 실행)
+DATA_FIELDS = {
+    'inventory': ['item', 'quantity'],
+    'prices': ['item', 'shoom_price', 'cash_price'],
+    'sales': ['_id', 'guild_id', 'type', 'period', 'timestamp', 'user_id', 'user_display_name', 'buyer_name', 'amount',
+              'items_sold', 'sale_id', 'total', 'count'],
+}
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '500'))
+MAX_IMPORT_ERRORS = 10
+
+def data_collection(kind):
+    return {'inventory': inventory_collection, 'prices': prices_collection, 'sales': sales_collection}[kind]
+
+def export_filename(kind, guild_id, file_format):
+    return f"{kind}-{guild_id}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{file_format}.gz"
+
+# 파일 이름으로 형식과 gzip 압축 여부를 판단 (예: sales.csv.gz)
+def detect_file_format(filename):
+    name = filename.lower()
+    compressed = name.endswith('.gz')
+    if compressed:
+        name = name[:-3]
+    for file_format in ('csv', 'jsonl'):
+        if name.endswith('.' + file_format):
+            return file_format, compressed
+    raise ValueError("파일 이름은 .csv, .jsonl (또는 .gz로 압축된 파일)로 끝나야 합니다.")
+
+def export_value(value, file_format):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if file_format == 'csv' and isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+def _export_records(kind, guild_id, file_format, path):
+    fields = DATA_FIELDS[kind]
+    projection = dict.fromkeys(fields, 1)
+    if '_id' not in fields:
+        projection['_id'] = 0
+    cursor = data_collection(kind).collection.find({'guild_id': guild_id}, projection, batch_size=EXPORT_BATCH_SIZE)
+    cursor = cursor.sort([('timestamp', 1), ('_id', 1)] if kind == 'sales' else [('item', 1)])
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            writer = csv.DictWriter(f, fields)
+            writer.writeheader()
+        for doc in cursor:
+            row = {field: export_value(doc[field], file_format) for field in fields if field in doc}
+            if file_format == 'csv':
+                writer.writerow(row)
+            else:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+# 파일의 각 행을 (행 번호, 원본 값)으로 읽음 (해석은 검사 단계에서 처리)
+def read_rows(path, file_format, compressed):
+    opener = gzip.open if compressed else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield line
+
+class ImportValidationError(Exception):
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} invalid rows')
+        self.errors = errors
+
+def parse_number(value, field):
+    if isinstance(value, bool):
+        raise ValueError(f'{field} 값이 숫자가 아닙니다: {value!r}')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} 값이 숫자가 아닙니다: {value!r}')
+    if not math.isfinite(number):
+        raise ValueError(f'{field} 값이 숫자가 아닙니다: {value!r}')
+    return int(number) if number.is_integer() else number
+
+# 정수 필드 (디스코드 ID는 2^53보다 커서 float을 거치면 값이 바뀌므로 JSON 정수는 그대로, 문자열은 Decimal로 변환)
+def parse_integer(value, field):
+    if isinstance(value, bool):
+        raise ValueError(f'{field} 값이 정수가 아닙니다: {value!r}')
+    if isinstance(value, int):
+        return value
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f'{field} 값이 정수가 아닙니다: {value!r}')
+    if not number.is_finite() or number != number.to_integral_value():
+        raise ValueError(f'{field} 값이 정수가 아닙니다: {value!r}')
+    return int(number)
+
+def parse_item(value):
+    item = catalog.resolve(str(value or ''))
+    if not item:
+        raise ValueError(f'카탈로그에 없는 아이템입니다: {value!r}')
+    return item
+
+def parse_object_id(value, field):
+    try:
+        return ObjectId(str(value))
+    except Exception:
+        raise ValueError(f'{field} 값이 올바른 ID가 아닙니다: {value!r}')
+
+# 다른 서버에서 내보낸 이벤트는 ID가 겹치지 않도록 (원래 ID, 대상 서버)로 정해지는 새 ID를 씀
+# (생성 시각 부분은 유지하고, 같은 파일을 다시 가져오면 같은 ID가 나옴)
+def remap_event_id(event_id, guild_id):
+    digest = hashlib.blake2b(event_id.binary + str(guild_id).encode(), digest_size=8).digest()
+    return ObjectId(event_id.binary[:4] + digest)
+
+# 한 행을 검사해 해당 서버에 쓸 업데이트로 변환 (CSV 값은 모두 문자열이므로 여기서 형 변환)
+def import_op(kind, guild_id, row, file_format):
+    record = json.loads(row) if file_format == 'jsonl' else {key: value for key, value in row.items() if value != ''}
+    if kind == 'inventory':
+        quantity = record.get('quantity', 'N/A')
+        if quantity != 'N/A':
+            quantity = parse_integer(quantity, 'quantity')
+            if quantity < 0:
+                raise ValueError(f'quantity는 0 이상의 정수여야 합니다: {quantity!r}')
+        return UpdateOne({'guild_id': guild_id, 'item': parse_item(record.get('item'))}, {'$set': {'quantity': quantity}}, upsert=True)
+    if kind == 'prices':
+        shoom_price = parse_number(record.get('shoom_price'), 'shoom_price')
+        cash_price = parse_number(record['cash_price'], 'cash_price') if 'cash_price' in record else shoom_price * 0.7
+        return UpdateOne({'guild_id': guild_id, 'item': parse_item(record.get('item'))},
+                         {'$set': {'shoom_price': shoom_price, 'cash_price': cash_price}}, upsert=True)
+
+    # 판매 원장 이벤트는 _id로 한 번만 추가되므로 같은 파일을 다시 가져와도 중복되지 않음
+    event_type = record.get('type', SALE)
+    if event_type not in (SALE, REVERSAL, SETTLEMENT):
+        raise ValueError(f'알 수 없는 이벤트 종류입니다: {event_type!r}')
+    items_sold = record.get('items_sold', [])
+    if isinstance(items_sold, str):
+        items_sold = json.loads(items_sold)
+    event = {
+        'guild_id': guild_id,
+        'type': event_type,
+        'period': parse_integer(record.get('period', 0), 'period'),
+        'timestamp': parse_number(record.get('timestamp'), 'timestamp'),
+        'items_sold': [[parse_item(item), parse_integer(quantity, 'quantity')] for item, quantity in items_sold],
+    }
+    for field in ('amount', 'user_id', 'total', 'count'):
+        if field in record:
+            event[field] = parse_integer(record[field], field)
+    for field in ('user_display_name', 'buyer_name'):
+        if field in record:
+            event[field] = str(record[field])
+    source_guild = parse_integer(record['guild_id'], 'guild_id') if 'guild_id' in record else guild_id
+    remap = (lambda event_id: event_id) if source_guild == guild_id else (lambda event_id: remap_event_id(event_id, guild_id))
+    if event_type == REVERSAL:
+        event['sale_id'] = remap(parse_object_id(record.get('sale_id'), 'sale_id'))
+    event_id = remap(parse_object_id(record['_id'], '_id')) if '_id' in record else ObjectId()
+    return UpdateOne({'_id': event_id}, {'$setOnInsert': event}, upsert=True)
+
+def _import_records(kind, guild_id, path, file_format, compressed):
+    errors = []
+    count = 0
+    for line_number, row in enumerate(read_rows(path, file_format, compressed), start=1):
+        try:
+            import_op(kind, guild_id, row, file_format)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            errors.append(f'{line_number}번째 행: {e}')
+            if len(errors) >= MAX_IMPORT_ERRORS:
+                break
+        count += 1
+    if errors:
+        raise ImportValidationError(errors)
+
+    collection = data_collection(kind).collection
+
+    def apply(session):
+        written = 0
+        chunk = []
+        for row in read_rows(path, file_format, compressed):
+            chunk.append(import_op(kind, guild_id, row, file_format))
+            if len(chunk) == IMPORT_CHUNK_SIZE:
+                result = collection.bulk_write(chunk, ordered=False, session=session)
+                written += result.upserted_count + result.modified_count
+                chunk = []
+        if chunk:
+            result = collection.bulk_write(chunk, ordered=False, session=session)
+            written += result.upserted_count + result.modified_count
+        return written
+    written = _run_transaction(apply)
+    if kind == 'sales':
+        # 가져온 이벤트가 들어간 기간의 합계를 원장에서 다시 계산
+        _rebuild_rollups(guild_id)
+    return count, written
+
+
+async def import_records(state, kind, path, file_format, compressed):
+    # 아직 저장되지 않은 시세가 가져온 값을 덮어쓰지 않도록 먼저 저장
+    await state.prices_writer.flush()
+    result = await data_collection(kind).run(_import_records, kind, state.guild_id, path, file_format, compressed)
+    await state.reload()
+    if kind == 'prices':
+        # 가져온 시세도 이력에 남김 (기록된 마지막 값과 같은 아이템은 쓰지 않음)
+        await state.record_price_history(list(state.prices))
+    return result
+
+# 작업 큐: 스크래핑/시세 반영/내보내기처럼 무거운 작업은 jobs 컬렉션에 넣고 워커 프로세스
+# (python discordbot.py --worker)가 가져가 프로세스 풀에서 실행, 봇은 결과만 기다림
+# (JOB_QUEUE가 꺼져 있으면 봇 안에서 바로 실행)
+JOB_QUEUE = os.getenv('JOB_QUEUE', '0') == '1'
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '0.5'))
+JOB_WAIT_SECONDS = float(os.getenv('JOB_WAIT_SECONDS', '300'))
+# 실행 중 상태로 이 시간보다 오래 남은 작업은 워커가 죽은 것으로 보고 다시 실행
+JOB_TIMEOUT_SECONDS = float(os.getenv('JOB_TIMEOUT_SECONDS', '600'))
+JOB_MAX_ATTEMPTS = 3
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '2'))
+
+class JobFailed(Exception):
+    def __init__(self, job):
+        super().__init__(f"{job['type']} job failed: {job.get('error')}")
+        self.job = job
+
+# 시장 시세 문자열("12.5k", "800", "1.2m")을 슘 단위 숫자로 변환 (해석할 수 없으면 None)
+MARKET_SUFFIXES = {'': 1, 'k': 1000, 'm': 1000000}
+
+def parse_market_value(text):
+    match = re.fullmatch(r'\s*(\d[\d,]*(?:\.\d+)?|\.\d+)\s*([km]?)\s*', str(text).lower())
+    if not match:
+        return None
+    return float(match.group(1).replace(',', '')) * MARKET_SUFFIXES[match.group(2)]
+
+def compute_reprice(creatures, market):
+    prices = []
+    for name in creatures:
+        value = parse_market_value(market.get(name, ''))
+        if value is not None:
+            prices.append((name, int(round_to_nearest(value))))
+    return prices
+
+async def scrape_job(params, executor=None):
+    return {'changed': await scrape_once(executor)}
+
+async def reprice_job(params, executor=None):
+    guild_id = params['guild_id']
+    await load_catalog()
+    docs = await creatures_collection.find_list({}, {'_id': 0, 'name': 1, 'shoom_price': 1})
+    market = {doc['name']: doc.get('shoom_price') for doc in docs}
+    prices = await asyncio.get_running_loop().run_in_executor(executor, compute_reprice, list(catalog.creatures), market)
+    if prices:
+        await prices_collection.bulk_write([UpdateOne({'guild_id': guild_id, 'item': item}, {'$set': {'shoom_price': price, 'cash_price': price * 0.7}}, upsert=True)
+                                            for item, price in prices], ordered=False)
+        await record_price_changes(guild_id, dict(prices))
+    return {'updated': len(prices)}
+
+# 내보낸 파일은 봇과 워커가 함께 쓰는 BASE_DIR/exports에 둠 (봇이 전송한 뒤 지움)
+async def export_job(params, executor=None):
+    kind, guild_id, file_format = params['kind'], params['guild_id'], params['file_format']
+    export_dir = os.path.join(BASE_DIR, 'exports')
+    os.makedirs(export_dir, exist_ok=True)
+    filename = export_filename(kind, guild_id, file_format)
+    path = os.path.join(export_dir, filename)
+    count = await asyncio.get_running_loop().run_in_executor(executor, _export_records, kind, guild_id, file_format, path)
+    return {'path': path, 'filename': filename, 'count': count}
+
+JOB_HANDLERS = {'scrape': scrape_job, 'reprice': reprice_job, 'export': export_job}
+
+# unique이면 같은 작업이 이미 대기 중이거나 실행 중일 때 새로 넣지 않고 그 작업을 기다림
+# (대기/실행 중인 동안만 active_key를 두고 그 필드에 고유 인덱스를 걸어, 여러 봇이 동시에 넣어도 하나만 들어감)
+def job_key(job_type, params):
+    return f'{job_type}:{json.dumps(params, sort_keys=True)}'
+
+def _enqueue_unique_job(job):
+    key = job_key(job['type'], job['params'])
+    for _ in range(2):
+        try:
+            return jobs_collection.collection.find_one_and_update(
+                {'active_key': key}, {'$setOnInsert': job}, upsert=True, return_document=ReturnDocument.AFTER)['_id']
+        except DuplicateKeyError:
+            # 동시에 들어온 다른 upsert가 먼저 넣었으면 다시 읽으면 그 작업이 나옴
+            continue
+    raise RuntimeError(f'could not enqueue {key}')
+
+async def enqueue_job(job_type, params, unique=False):
+    job = {'type': job_type, 'params': params, 'status': 'queued', 'attempts': 0, 'created_at': datetime.now(timezone.utc)}
+    if unique:
+        return await jobs_collection.run(_enqueue_unique_job, job)
+    result = await jobs_collection.insert_one(job)
+    return result.inserted_id
+
+async def wait_for_job(job_id, timeout=JOB_WAIT_SECONDS):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = await jobs_collection.find_one({'_id': job_id})
+        if job['status'] == 'done':
+            return job['result']
+        if job['status'] == 'failed':
+            raise JobFailed(job)
+        await asyncio.sleep(JOB_POLL_SECONDS)
+    raise asyncio.TimeoutError(f'job {job_id} did not finish within {timeout}s')
+
+async def run_job(job_type, params=None, unique=False):
+    params = params or {}
+    if not JOB_QUEUE:
+        return await JOB_HANDLERS[job_type](params)
+    job_id = await enqueue_job(job_type, params, unique or job_type == 'scrape')
+    return await wait_for_job(job_id)
+
+# 가장 오래된 대기 작업(또는 시간이 지난 실행 중 작업)을 원자적으로 가져감
+def _claim_job(worker_id):
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=JOB_TIMEOUT_SECONDS)
+    return jobs_collection.collection.find_one_and_update(
+        {'$or': [{'status': 'queued'}, {'status': 'running', 'started_at': {'$lt': stale}, 'attempts': {'$lt': JOB_MAX_ATTEMPTS}}]},
+        {'$set': {'status': 'running', 'started_at': now, 'worker': worker_id}, '$inc': {'attempts': 1}},
+        sort=[('created_at', 1)], return_document=ReturnDocument.AFTER)
+
+def _fail_abandoned_jobs():
+    stale = datetime.now(timezone.utc) - timedelta(seconds=JOB_TIMEOUT_SECONDS)
+    jobs_collection.collection.update_many(
+        {'status': 'running', 'started_at': {'$lt': stale}, 'attempts': {'$gte': JOB_MAX_ATTEMPTS}},
+        {'$set': {'status': 'failed', 'error': 'timed out', 'finished_at': datetime.now(timezone.utc)}, '$unset': {'active_key': ''}})
+
+async def execute_job(job, executor):
+    started = time.perf_counter()
+    try:
+        result = await JOB_HANDLERS[job['type']](job.get('params', {}), executor)
     except Exception as e:
-        print(f'Error saving prices: {e}')
+        print(f"Job {job['_id']} ({job['type']}) failed: {e!r}")
+        await jobs_collection.update_one({'_id': job['_id']}, {'$set': {'status': 'failed', 'error': repr(e), 'finished_at': datetime.now(timezone.utc)},
+                                                               '$unset': {'active_key': ''}})
+        return
+    await jobs_collection.update_one({'_id': job['_id']}, {'$set': {'status': 'done', 'result': result, 'finished_at': datetime.now(timezone.utc)},
+                                                           '$unset': {'active_key': ''}})
+    print(f"Job {job['_id']} ({job['type']}) done in {time.perf_counter() - started:.1f}s: {result}")
+
+# 워커 모드: 게이트웨이에 접속하지 않고 작업만 처리 (CPU 작업은 spawn 방식 프로세스 풀에서 실행)
+async def run_worker():
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    pool = ProcessPoolExecutor(max_workers=WORKER_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+    await load_catalog()
+    await ensure_indexes()
+    print(f'Worker {worker_id} started with {WORKER_PROCESSES} processes')
+    running = set()
+    try:
+        while True:
+            job = await jobs_collection.run(_claim_job, worker_id) if len(running) < WORKER_PROCESSES else None
+            if job is None:
+                await jobs_collection.run(_fail_abandoned_jobs)
+                await asyncio.sleep(JOB_POLL_SECONDS)
+                continue
+            task = asyncio.create_task(execute_job(job, pool))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        if http_session is not None:
+            await http_session.close()
+
+# 명령줄에서 봇을 띄우지 않고 내보내기/가져오기 실행
+# 예: python discordbot.py export sales --guild-id 123 --format jsonl
+#     python discordbot.py import inventory inventory.csv.gz --guild-id 123
+def run_cli(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog='discordbot.py')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='export a collection to a gzip CSV/JSONL file')
+    export_parser.add_argument('kind', choices=DATA_FIELDS)
+    export_parser.add_argument('--guild-id', type=int, required=True)
+    export_parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+    export_parser.add_argument('--output', help='output path (default: <kind>-<guild>-<time>.<format>.gz)')
+    import_parser = subparsers.add_parser('import', help='import a CSV/JSONL file (optionally .gz)')
+    import_parser.add_argument('kind', choices=DATA_FIELDS)
+    import_parser.add_argument('path')
+    import_parser.add_argument('--guild-id', type=int, required=True)
+    args = parser.parse_args(argv)
+
+    async def main():
+        await load_catalog()
+        if args.command == 'export':
+            output = args.output or export_filename(args.kind, args.guild_id, args.format)
+            count = await data_collection(args.kind).run(_export_records, args.kind, args.guild_id, args.format, output)
+            print(f'Exported {count} {args.kind} records to {output}')
+            return 0
+        file_format, compressed = detect_file_format(args.path)
+        state = await guild_states.get(args.guild_id)
+        try:
+            count, written = await import_records(state, args.kind, args.path, file_format, compressed)
+        except ImportValidationError as e:
+            print('Import aborted, invalid rows:\n' + '\n'.join(e.errors))
+            return 1
+        print(f'Checked {count} {args.kind} records, wrote {written}')
+        return 0
+    return asyncio.run(main())
 
 # 디스코드 토큰을 환경 변수에서 가져와 실행
 if __name__ == '__main__':
+    if sys.argv[1:] == ['--worker']:
+        asyncio.run(run_worker())
+        sys.exit(0)
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
+
     discord_token = os.getenv('DISCORD_BOT_TOKEN')
 
     # 토큰이 제대로 로드되었는지 확인